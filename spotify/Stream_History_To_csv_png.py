@@ -1,167 +1,261 @@
 #!/usr/bin/env python3
 
 import json
+import hashlib
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Solo se guardan PNG; además permite dibujar en procesos
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import chain
 from datetime import datetime
 
+# orjson: opcional, parsea JSON bastante más rápido que el módulo estándar
+HAS_ORJSON = False
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    pass
+
+# pyarrow: opcional, permite cachear los datos procesados en Parquet
+HAS_PYARROW = False
+try:
+    import pyarrow
+    import pyarrow.csv
+    HAS_PYARROW = True
+except ImportError:
+    pass
+
+ARCHIVO_CACHE = 'historial_spotify_procesado.parquet'
+ARCHIVO_FIRMA_CACHE = ARCHIVO_CACHE + '.firma'
+
+# Campos del export de Spotify que necesita el análisis
+COLUMNAS_USADAS = [
+    'ts',
+    'ms_played',
+    'master_metadata_track_name',
+    'master_metadata_album_artist_name',
+]
+
+# Resolución y compresión de los PNG: 150 dpi es suficiente para pantalla y
+# zlib al nivel 1 codifica mucho más rápido a cambio de archivos algo mayores
+DPI_GRAFICOS = 150
+OPCIONES_PNG = {'compress_level': 1}
+
 # Configuración de estilo para los gráficos
 plt.style.use('seaborn-v0_8-darkgrid')
 sns.set_palette("husl")
 
+def _cargar_archivo_json(archivo):
+    """
+    Carga un único archivo JSON del historial y devuelve solo los campos
+    usados, como un diccionario {campo: lista de valores}
+    """
+    print(f"Cargando {archivo.name}...")
+    if HAS_ORJSON:
+        registros = orjson.loads(archivo.read_bytes())
+    else:
+        with open(archivo, 'r', encoding='utf-8') as f:
+            registros = json.load(f)
+    
+    # Los diccionarios de cada reproducción se liberan al salir: en memoria
+    # solo quedan las columnas necesarias, no el export completo
+    return {campo: [registro.get(campo) for registro in registros] for campo in COLUMNAS_USADAS}
+
 def cargar_archivos_json(directorio='.'):
     """
-    Carga todos los archivos JSON del historial de Spotify
+    Carga todos los archivos JSON del historial de Spotify.
+    Devuelve un diccionario {campo: lista de valores} con los campos de COLUMNAS_USADAS
     """
-    archivos = Path(directorio).glob('Streaming_History_Audio_*.json')
-    todos_los_datos = []
+    archivos = sorted(Path(directorio).glob('Streaming_History_Audio_*.json'))
     
-    for archivo in archivos:
-        print(f"Cargando {archivo.name}...")
-        with open(archivo, 'r', encoding='utf-8') as f:
-            datos = json.load(f)
-            todos_los_datos.extend(datos)
+    # Los archivos se leen y parsean en paralelo
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(archivos)))) as executor:
+        resultados = list(executor.map(_cargar_archivo_json, archivos))
+    todos_los_datos = {
+        campo: list(chain.from_iterable(resultado[campo] for resultado in resultados))
+        for campo in COLUMNAS_USADAS
+    }
     
-    print(f"Total de reproducciones cargadas: {len(todos_los_datos)}")
+    print(f"Total de reproducciones cargadas: {len(todos_los_datos['ts'])}")
     return todos_los_datos
 
+def firma_historial(directorio='.'):
+    """
+    Firma de los JSON del historial (nombre, tamaño y fecha de modificación),
+    para saber si la caché Parquet corresponde a los archivos actuales
+    """
+    firma = hashlib.blake2b(digest_size=16)
+    for archivo in sorted(Path(directorio).glob('Streaming_History_Audio_*.json')):
+        info = archivo.stat()
+        firma.update(f"{archivo.name}:{info.st_size}:{info.st_mtime_ns}\n".encode())
+    return firma.hexdigest()
+
+def cargar_cache_parquet(directorio='.'):
+    """
+    Carga los datos procesados desde la caché Parquet si se generó a partir
+    de los mismos JSON del historial. Devuelve None si no se puede usar.
+    """
+    cache = Path(directorio) / ARCHIVO_CACHE
+    firma = Path(directorio) / ARCHIVO_FIRMA_CACHE
+    if not HAS_PYARROW or not cache.exists() or not firma.exists():
+        return None
+    
+    hay_json = any(Path(directorio).glob('Streaming_History_Audio_*.json'))
+    if hay_json and firma.read_text().strip() != firma_historial(directorio):
+        return None
+    
+    print(f"Cargando datos procesados desde {ARCHIVO_CACHE}...")
+    # memory_map: el archivo se lee directamente desde la caché de páginas del SO
+    return pd.read_parquet(cache, engine='pyarrow', memory_map=True)
+
+def guardar_cache_parquet(df, directorio='.'):
+    """
+    Guarda los datos procesados en la caché Parquet junto con la firma
+    de los JSON de los que salen
+    """
+    df.to_parquet(Path(directorio) / ARCHIVO_CACHE, engine='pyarrow', compression='zstd', index=False)
+    (Path(directorio) / ARCHIVO_FIRMA_CACHE).write_text(firma_historial(directorio) + '\n')
+
 def procesar_datos(datos):
     """
     Convierte los datos JSON en un DataFrame de pandas y procesa las fechas
     """
-    df = pd.DataFrame(datos)
+    # cargar_archivos_json ya descarta el resto de campos del export
+    # (ip_addr, platform, reason_start...)
+    df = pd.DataFrame(datos, columns=COLUMNAS_USADAS)
     
     # Convertir timestamp a datetime
-    df['ts'] = pd.to_datetime(df['ts'])
+    # (Spotify siempre usa ISO 8601 en UTC; con el formato explícito no se
+    # intenta adivinar el formato de cada fila)
+    df['ts'] = pd.to_datetime(df['ts'], format='%Y-%m-%dT%H:%M:%SZ', utc=True, cache=True)
     
     # Convertir milisegundos a minutos
     df['minutos_reproducidos'] = df['ms_played'] / 60000
     
     # Extraer año, mes, día
-    df['año'] = df['ts'].dt.year
-    df['mes'] = df['ts'].dt.month
-    df['año_mes'] = df['ts'].dt.to_period('M')
-    df['nombre_mes'] = df['ts'].dt.strftime('%B %Y')
+    df['año'] = df['ts'].dt.year.astype('int16')
+    df['mes'] = df['ts'].dt.month.astype('int8')
+    df['año_mes'] = df['ts'].dt.tz_localize(None).dt.to_period('M')
+    # strftime solo una vez por mes distinto, no por cada reproducción
+    df['nombre_mes'] = pd.Categorical(df['año_mes']).rename_categories(
+        lambda periodo: periodo.strftime('%B %Y')
+    )
     
     # Filtrar solo canciones (no podcasts ni audiolibros)
     df = df[df['master_metadata_track_name'].notna()]
     
+    # Artistas y canciones se repiten mucho: como categorías ocupan menos
+    # y las agrupaciones trabajan sobre códigos enteros
+    df = df.astype({
+        'master_metadata_album_artist_name': 'category',
+        'master_metadata_track_name': 'category',
+    })
+    
     return df
 
+def sumar_minutos(datos, claves):
+    """
+    Suma los minutos reproducidos agrupando por `claves`. `datos` puede ser el
+    DataFrame completo o una Serie ya sumada por más claves (p. ej. por mes),
+    que es mucho más pequeña de recorrer que el historial entero.
+    """
+    if isinstance(datos, pd.Series):
+        return datos.groupby(level=claves, observed=True, sort=False).sum()
+    return datos.groupby(claves, observed=True, sort=False)['minutos_reproducidos'].sum()
+
+def top_por_periodo(minutos, periodo, top_n=10):
+    """
+    Calcula en una sola pasada el top_n de una Serie de `sumar_minutos` para
+    cada valor de `periodo` (p. ej. ['año'] o ['año', 'mes']).
+    Devuelve un diccionario {(año,) o (año, mes): Serie}
+    """
+    columnas = [nombre for nombre in minutos.index.names if nombre not in periodo]
+    # Un único sort global + head por grupo es mucho más rápido que un
+    # nlargest por grupo cuando hay cientos de meses
+    top = minutos.sort_values(ascending=False).groupby(level=periodo, sort=False).head(top_n)
+    
+    # Etiqueta "columna1 - columna2 - ..." construida de una vez para todos los grupos
+    etiquetas = top.index.get_level_values(columnas[0]).astype(str)
+    for columna in columnas[1:]:
+        etiquetas = etiquetas + ' - ' + top.index.get_level_values(columna).astype(str)
+    top.index = pd.MultiIndex.from_arrays(
+        [top.index.get_level_values(p) for p in periodo] + [etiquetas],
+        names=periodo + [None],
+    )
+    
+    return {clave: serie.droplevel(periodo)
+            for clave, serie in top.groupby(level=periodo, sort=False)}
+
 def minutos_por_mes(df):
     """
-    Calcula y grafica los minutos reproducidos por mes
+    Calcula y grafica los minutos reproducidos por mes. Devuelve un
+    DataFrame con columnas año, mes y minutos_reproducidos, ordenado por fecha
     """
-    minutos_mes = df.groupby('año_mes')['minutos_reproducidos'].sum().reset_index()
-    minutos_mes['año_mes'] = minutos_mes['año_mes'].astype(str)
+    minutos_mes = df.groupby(['año', 'mes'], sort=True)['minutos_reproducidos'].sum().reset_index()
+    etiquetas = [f"{año}-{mes:02d}" for año, mes in zip(minutos_mes['año'], minutos_mes['mes'])]
     
     plt.figure(figsize=(15, 6))
-    plt.bar(minutos_mes['año_mes'], minutos_mes['minutos_reproducidos'], color='#1DB954')
+    plt.bar(etiquetas, minutos_mes['minutos_reproducidos'], color='#1DB954')
     plt.xlabel('Mes', fontsize=12)
     plt.ylabel('Minutos Reproducidos', fontsize=12)
     plt.title('Minutos Reproducidos por Mes', fontsize=16, fontweight='bold')
     plt.xticks(rotation=45, ha='right')
     plt.tight_layout()
-    plt.savefig('minutos_por_mes.png', dpi=300, bbox_inches='tight')
+    plt.savefig('minutos_por_mes.png', dpi=DPI_GRAFICOS, pil_kwargs=OPCIONES_PNG)
     plt.close()
     
     return minutos_mes
 
-def top_artistas_mes(df, año, mes, top_n=10):
+def graficar_top(ax, top, color, etiqueta_y, titulo, archivo):
     """
-    Obtiene el top 10 de artistas de un mes específico
+    Dibuja un top como barras horizontales reutilizando los ejes `ax`
+    y lo guarda en `archivo`
     """
-    df_mes = df[(df['año'] == año) & (df['mes'] == mes)]
-    
-    if len(df_mes) == 0:
-        return None
-    
-    top_artistas = df_mes.groupby('master_metadata_album_artist_name')['minutos_reproducidos'].sum().sort_values(ascending=False).head(top_n)
-    
-    plt.figure(figsize=(12, 8))
-    top_artistas.plot(kind='barh', color='#1DB954')
-    plt.xlabel('Minutos Reproducidos', fontsize=12)
-    plt.ylabel('Artista', fontsize=12)
-    plt.title(f'Top {top_n} Artistas - {mes:02d}/{año}', fontsize=16, fontweight='bold')
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-    plt.savefig(f'top_artistas_{año}_{mes:02d}.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    return top_artistas
+    posiciones = range(len(top))
+    ax.clear()
+    ax.barh(posiciones, top.to_numpy(), color=color)
+    ax.set_yticks(posiciones, top.index.astype(str))
+    ax.set_xlabel('Minutos Reproducidos', fontsize=12)
+    ax.set_ylabel(etiqueta_y, fontsize=12)
+    ax.set_title(titulo, fontsize=16, fontweight='bold')
+    ax.invert_yaxis()
+    ax.figure.tight_layout()
+    ax.figure.savefig(archivo, dpi=DPI_GRAFICOS, pil_kwargs=OPCIONES_PNG)
 
-def top_artistas_año(df, año, top_n=10):
-    """
-    Obtiene el top 10 de artistas de un año específico
-    """
-    df_año = df[df['año'] == año]
-    
-    if len(df_año) == 0:
-        return None
-    
-    top_artistas = df_año.groupby('master_metadata_album_artist_name')['minutos_reproducidos'].sum().sort_values(ascending=False).head(top_n)
-    
-    plt.figure(figsize=(12, 8))
-    top_artistas.plot(kind='barh', color='#1ED760')
-    plt.xlabel('Minutos Reproducidos', fontsize=12)
-    plt.ylabel('Artista', fontsize=12)
-    plt.title(f'Top {top_n} Artistas - {año}', fontsize=16, fontweight='bold')
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-    plt.savefig(f'top_artistas_{año}.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    return top_artistas
+# Ejes reutilizados dentro de cada proceso trabajador, uno por tamaño de figura
+_ejes_por_tamaño = {}
 
-def top_canciones_mes(df, año, mes, top_n=10):
+def _graficar_en_proceso(tarea):
     """
-    Obtiene el top 10 de canciones de un mes específico
+    Dibuja un top (tarea de generar_todos_los_graficos) en un proceso trabajador
     """
-    df_mes = df[(df['año'] == año) & (df['mes'] == mes)]
-    
-    if len(df_mes) == 0:
-        return None
-    
-    df_mes['cancion_artista'] = df_mes['master_metadata_track_name'] + ' - ' + df_mes['master_metadata_album_artist_name']
-    top_canciones = df_mes.groupby('cancion_artista')['minutos_reproducidos'].sum().sort_values(ascending=False).head(top_n)
-    
-    plt.figure(figsize=(12, 10))
-    top_canciones.plot(kind='barh', color='#1DB954')
-    plt.xlabel('Minutos Reproducidos', fontsize=12)
-    plt.ylabel('Canción', fontsize=12)
-    plt.title(f'Top {top_n} Canciones - {mes:02d}/{año}', fontsize=16, fontweight='bold')
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-    plt.savefig(f'top_canciones_{año}_{mes:02d}.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    return top_canciones
+    tamaño, *args = tarea
+    if tamaño not in _ejes_por_tamaño:
+        _ejes_por_tamaño[tamaño] = plt.subplots(figsize=tamaño)[1]
+    graficar_top(_ejes_por_tamaño[tamaño], *args)
 
-def top_canciones_año(df, año, top_n=10):
+def guardar_csv(df, archivo):
     """
-    Obtiene el top 10 de canciones de un año específico
+    Guarda el DataFrame en CSV, con el escritor de pyarrow (multihilo, en C++)
+    si está disponible
     """
-    df_año = df[df['año'] == año]
-    
-    if len(df_año) == 0:
-        return None
-    
-    df_año['cancion_artista'] = df_año['master_metadata_track_name'] + ' - ' + df_año['master_metadata_album_artist_name']
-    top_canciones = df_año.groupby('cancion_artista')['minutos_reproducidos'].sum().sort_values(ascending=False).head(top_n)
-    
-    plt.figure(figsize=(12, 10))
-    top_canciones.plot(kind='barh', color='#1ED760')
-    plt.xlabel('Minutos Reproducidos', fontsize=12)
-    plt.ylabel('Canción', fontsize=12)
-    plt.title(f'Top {top_n} Canciones - {año}', fontsize=16, fontweight='bold')
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-    plt.savefig(f'top_canciones_{año}.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    return top_canciones
+    if not HAS_PYARROW:
+        df.to_csv(archivo, index=False, encoding='utf-8')
+        return
+    
+    # El CSV de pyarrow no sabe escribir Period; ts se guarda con resolución de segundos
+    tabla = pyarrow.Table.from_pandas(
+        df.assign(año_mes=df['año_mes'].astype(str)), preserve_index=False
+    )
+    tabla = tabla.set_column(
+        tabla.schema.get_field_index('ts'), 'ts',
+        tabla['ts'].cast(pyarrow.timestamp('s', tz='UTC')),
+    )
+    pyarrow.csv.write_csv(tabla, archivo)
 
 def resumen_estadisticas(df):
     """
@@ -178,42 +272,68 @@ def resumen_estadisticas(df):
     print(f"Período: {df['ts'].min().date()} a {df['ts'].max().date()}")
     print("="*60 + "\n")
 
-def generar_todos_los_graficos(df):
+def generar_todos_los_graficos(df, top_n=10):
     """
     Genera todos los gráficos para cada año y cada mes disponible
     """
-    # Obtener años y meses únicos
-    años = sorted(df['año'].unique())
+    artista = ['master_metadata_album_artist_name']
+    cancion = ['master_metadata_track_name', 'master_metadata_album_artist_name']
     
     print("\n" + "="*60)
     print("GENERANDO GRÁFICOS")
     print("="*60)
     
-    # Generar gráficos por año
-    print("\n📊 Generando gráficos anuales...")
-    for año in años:
-        print(f"  - Año {año}")
-        top_artistas_año(df, año)
-        top_canciones_año(df, año)
-    
-    # Generar gráficos por mes
-    print("\n📊 Generando gráficos mensuales...")
-    for año in años:
-        meses_del_año = sorted(df[df['año'] == año]['mes'].unique())
-        for mes in meses_del_año:
-            print(f"  - {año}-{mes:02d}")
-            top_artistas_mes(df, año, mes)
-            top_canciones_mes(df, año, mes)
+    # Calcular todos los tops de una vez en lugar de filtrar por cada gráfico.
+    # Los totales anuales se sacan de los mensuales, sin volver a recorrer df
+    minutos_artistas = sumar_minutos(df, ['año', 'mes'] + artista)
+    minutos_canciones = sumar_minutos(df, ['año', 'mes'] + cancion)
+    artistas_mes = top_por_periodo(minutos_artistas, ['año', 'mes'], top_n)
+    canciones_mes = top_por_periodo(minutos_canciones, ['año', 'mes'], top_n)
+    artistas_año = top_por_periodo(sumar_minutos(minutos_artistas, ['año'] + artista), ['año'], top_n)
+    canciones_año = top_por_periodo(sumar_minutos(minutos_canciones, ['año'] + cancion), ['año'], top_n)
+    
+    # Texto del título y sufijo del archivo de cada periodo, calculados una vez
+    nombres_periodo = {(año,): (f'{año}', f'{año}') for (año,) in artistas_año}
+    nombres_periodo.update(
+        {(año, mes): (f'{mes:02d}/{año}', f'{año}_{mes:02d}') for año, mes in artistas_mes}
+    )
+    
+    # (tops, color, etiqueta del eje, nombre, tamaño de la figura)
+    graficos = [
+        (artistas_año, '#1ED760', 'Artista', 'Artistas', (12, 8)),
+        (canciones_año, '#1ED760', 'Canción', 'Canciones', (12, 10)),
+        (artistas_mes, '#1DB954', 'Artista', 'Artistas', (12, 8)),
+        (canciones_mes, '#1DB954', 'Canción', 'Canciones', (12, 10)),
+    ]
+    
+    # Cada gráfico es una tarea pequeña (solo el top ya calculado); cada proceso
+    # reutiliza una figura por tamaño
+    tareas = []
+    for tops, color, etiqueta_y, nombre, tamaño in graficos:
+        for clave in sorted(tops):
+            texto, sufijo = nombres_periodo[clave]
+            tareas.append((tamaño, tops[clave], color, etiqueta_y,
+                           f'Top {top_n} {nombre} - {texto}',
+                           f'top_{nombre.lower()}_{sufijo}.png'))
+    
+    print(f"\n📊 Generando {len(tareas)} gráficos anuales y mensuales en paralelo...")
+    with ProcessPoolExecutor() as executor:
+        for _ in executor.map(_graficar_en_proceso, tareas, chunksize=8):
+            pass
     
     print("\n✅ Todos los gráficos generados!")
 
 # EJECUCIÓN PRINCIPAL
 if __name__ == "__main__":
-    # 1. Cargar datos
-    datos = cargar_archivos_json()
+    # 1. Cargar datos (desde la caché Parquet si corresponde a los JSON actuales)
+    df = cargar_cache_parquet()
+    desde_cache = df is not None
     
-    # 2. Procesar datos
-    df = procesar_datos(datos)
+    if not desde_cache:
+        datos = cargar_archivos_json()
+        
+        # 2. Procesar datos
+        df = procesar_datos(datos)
     
     # 3. Mostrar resumen
     resumen_estadisticas(df)
@@ -224,9 +344,8 @@ if __name__ == "__main__":
     
     # 5. Guardar CSV de Año-Mes-Minutos
     print("\n💾 Guardando CSV de minutos por mes...")
-    minutos_mes_csv = df.groupby(['año', 'mes'])['minutos_reproducidos'].sum().reset_index()
-    minutos_mes_csv.columns = ['Año', 'Mes', 'Minutos']
-    minutos_mes_csv = minutos_mes_csv.sort_values(['Año', 'Mes'])
+    # Reutiliza la agregación mensual del gráfico anterior, que ya está ordenada
+    minutos_mes_csv = minutos_mes.set_axis(['Año', 'Mes', 'Minutos'], axis=1)
     minutos_mes_csv.to_csv('minutos_por_año_mes.csv', index=False, encoding='utf-8')
     print("✅ CSV guardado: minutos_por_año_mes.csv")
     
@@ -235,9 +354,14 @@ if __name__ == "__main__":
     
     # 7. Guardar datos procesados completos en CSV
     print("\n💾 Guardando datos procesados completos en CSV...")
-    df.to_csv('historial_spotify_procesado.csv', index=False, encoding='utf-8')
+    guardar_csv(df, 'historial_spotify_procesado.csv')
     print("✅ CSV guardado: historial_spotify_procesado.csv")
     
+    # 8. Guardar caché Parquet para acelerar las siguientes ejecuciones
+    if HAS_PYARROW and not desde_cache:
+        guardar_cache_parquet(df)
+        print(f"✅ Caché guardada: {ARCHIVO_CACHE}")
+    
     print("\n" + "="*60)
     print("🎉 ANÁLISIS COMPLETADO")
     print("="*60)
@@ -249,4 +373,6 @@ if __name__ == "__main__":
     print("  📊 top_canciones_[año]_[mes].png (para cada mes)")
     print("  📄 minutos_por_año_mes.csv")
     print("  📄 historial_spotify_procesado.csv")
+    if HAS_PYARROW:
+        print(f"  📄 {ARCHIVO_CACHE}")
     print("="*60 + "\n")
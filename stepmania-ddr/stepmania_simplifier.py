@@ -3,10 +3,59 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
+import codecs
 import re
 from typing import List, Dict, Tuple
-import copy
 import random
+import queue
+import threading
+from functools import lru_cache
+from collections import Counter
+
+# Un único patrón para todas las etiquetas '#CLAVE:valor;' del archivo, así el
+# contenido se recorre una sola vez (cabeceras y bloques #NOTES a la vez)
+TAG_PATTERN = re.compile(r'#([A-Za-z0-9]+):([^;]*);')
+HEADER_TAGS = {'TITLE': 'title', 'ARTIST': 'artist', 'BPMS': 'bpms', 'OFFSET': 'offset'}
+# Línea de notas: sus 4 primeros caracteres son 0-4, M, F, L o K
+NOTE_LINE_PATTERN = re.compile(r'[01234MFLKmflk]{4}')
+
+# Subdivisión detectada -> sufijo de las opciones remove_X / keep_percentage_X
+SUBDIVISION_OPTIONS = {'24th+': '24th', '16th': '16th', '12th': '12th', '8th': '8th'}
+
+# Tablas para editar las 4 columnas de una línea de una vez con str.translate
+CLEAR_NOTES = str.maketrans('124', '000')          # Quitar Tap, Hold y Roll
+HOLDS_TO_TAPS = str.maketrans({'2': '1', '3': '0', '4': '1'})
+
+# Casos comunes para 4/4 time signature, por orden de prioridad: 48ths (o 24ths si son
+# pares), 32nds, 24ths, 16ths, 12ths (triplets over 4th), 8ths, 6ths (triplets over 8th,
+# raro pero posible) y 4ths
+BEAT_DIVISIONS = (48, 32, 24, 16, 12, 8, 6, 4)
+
+@lru_cache(maxsize=64)
+def measure_beat_division(total_lines_in_measure: int):
+    # La división depende solo del tamaño del compás, así que se decide una vez por
+    # tamaño. Si no hay una división clara devuelve directamente la subdivisión (str)
+    # que corresponde a todas las líneas del compás
+    beat_division = next((d for d in BEAT_DIVISIONS if total_lines_in_measure % d == 0), None)
+    if beat_division:
+        return beat_division
+    elif total_lines_in_measure % 3 == 0 and total_lines_in_measure <= 12 : # Podría ser un compás de 3/4 en 4ths, o 4/4 en 3 notas por alguna razón
+        return total_lines_in_measure # ej. 3 notas: 3rd, 9 notas: 9th
+    elif total_lines_in_measure % 2 == 0 and total_lines_in_measure <= 8:
+        return total_lines_in_measure
+    else: # Casos menos comunes o compases con pocas notas
+        if total_lines_in_measure > 16 : return "24th+" # Si hay muchas, default a muy rápidas
+        if total_lines_in_measure > 12 : return "16th"
+        if total_lines_in_measure > 8 : return "12th"
+        if total_lines_in_measure > 4 : return "8th"
+        return "4th"
+
+@lru_cache(maxsize=64)
+def measure_subdivisions(total_lines: int) -> Tuple[str, ...]:
+    # La subdivisión solo depende del índice y del tamaño del compás, y los tamaños
+    # se repiten mucho (4, 8, 16...), así que se calcula una vez por tamaño
+    return tuple(StepManiaSimplifier.detect_note_subdivision_in_measure(i, total_lines)
+                 for i in range(total_lines))
 
 class StepManiaSimplifier:
     def __init__(self, root):
@@ -16,6 +65,11 @@ class StepManiaSimplifier:
 
         self.current_file = None
         self.chart_data = {}
+        # Mensajes de debug pendientes de volcar al widget; se pueden añadir desde el hilo de trabajo
+        self.debug_queue = queue.Queue()
+        self.debug_enabled = True # Copia en un bool de la casilla de debug, legible desde el hilo de trabajo
+        self.simplify_result = None # Resultado que deja el hilo de simplificación
+        self.rng = random.Random() # simplify_chart lo sustituye por uno con la semilla elegida
 
         # Configuración para las opciones de notas
         self.note_options_config = [
@@ -27,6 +81,7 @@ class StepManiaSimplifier:
         self.keep_percentage_values = ["0%", "10%", "25%", "50%", "75%"]
 
         self.setup_ui()
+        self.root.after(50, self.flush_debug)
 
     def create_note_option_frame(self, parent, row, config):
         frame = ttk.Frame(parent)
@@ -201,6 +256,11 @@ class StepManiaSimplifier:
         ttk.Label(options_frame, text="Nombre nueva dificultad:").grid(row=current_row, column=0, sticky=tk.W, padx=(10, 0))
         self.new_difficulty_name = tk.StringVar(value="Easy")
         ttk.Entry(options_frame, textvariable=self.new_difficulty_name, width=15).grid(row=current_row, column=1, sticky=tk.W, padx=5)
+        current_row += 1
+
+        ttk.Label(options_frame, text="Semilla aleatoria (opcional):").grid(row=current_row, column=0, sticky=tk.W, padx=(10, 0))
+        self.random_seed = tk.StringVar(value="") # Vacío = resultado distinto en cada generación
+        ttk.Entry(options_frame, textvariable=self.random_seed, width=15).grid(row=current_row, column=1, sticky=tk.W, padx=5)
 
     def setup_buttons(self, parent, row):
         button_frame = ttk.Frame(parent)
@@ -208,7 +268,8 @@ class StepManiaSimplifier:
 
         # El botón de Analizar ya no es necesario aquí, se hace al cargar
         # ttk.Button(button_frame, text="Analizar Archivo", command=self.analyze_file).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="Generar Versión Simplificada", command=self.generate_simplified).pack(side=tk.LEFT, padx=5)
+        self.generate_button = ttk.Button(button_frame, text="Generar Versión Simplificada", command=self.generate_simplified)
+        self.generate_button.pack(side=tk.LEFT, padx=5)
 
     def setup_info_area(self, parent, row):
         info_frame = ttk.LabelFrame(parent, text="Información del Archivo", padding="10")
@@ -228,6 +289,13 @@ class StepManiaSimplifier:
         self.debug_text = scrolledtext.ScrolledText(debug_frame, height=5, width=70, wrap=tk.WORD) # wrap=tk.WORD
         self.debug_text.grid(row=0, column=0, sticky=(tk.W, tk.E))
 
+        self.debug_enabled_var = tk.BooleanVar(value=self.debug_enabled)
+        ttk.Checkbutton(debug_frame, text="Mostrar mensajes de debug", variable=self.debug_enabled_var,
+                       command=self.toggle_debug).grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+
+    def toggle_debug(self):
+        self.debug_enabled = self.debug_enabled_var.get()
+
     def browse_file(self):
         filename = filedialog.askopenfilename(
             title="Seleccionar archivo .sm",
@@ -239,63 +307,74 @@ class StepManiaSimplifier:
             self.analyze_file() # <--- ANÁLISIS AUTOMÁTICO
 
     def parse_sm_file(self, filepath: str) -> Dict:
-        # Intenta con 'utf-8' primero, que es lo más común y robusto
-        encodings_to_try = ['utf-8', 'cp1252', 'iso-8859-1', 'latin1']
+        # El archivo se lee una sola vez y los encodings se prueban sobre los bytes en memoria
+        try:
+            with open(filepath, 'rb') as f:
+                raw = f.read()
+        except Exception as e:
+            messagebox.showerror("Error de Lectura", f"No se pudo leer el archivo '{os.path.basename(filepath)}'.\n{e}")
+            return {}
+
+        if raw.startswith(codecs.BOM_UTF8):
+            encodings_to_try = ['utf-8-sig']
+        elif raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            encodings_to_try = ['utf-16']
+        else:
+            # 'utf-8' primero, que es lo más común y robusto; 'iso-8859-1' nunca falla
+            encodings_to_try = ['utf-8', 'cp1252', 'iso-8859-1']
         content = None
-        
+        used_encoding = None
+
         for encoding in encodings_to_try:
             try:
-                with open(filepath, 'r', encoding=encoding) as f:
-                    content = f.read()
+                content = raw.decode(encoding)
+                used_encoding = encoding
                 self.debug_print(f"Archivo leído exitosamente con encoding: {encoding}")
-                break 
+                break
             except UnicodeDecodeError:
                 self.debug_print(f"Fallo al leer con encoding: {encoding}")
-                continue
-            except Exception as e:
-                self.debug_print(f"Error inesperado al abrir el archivo con {encoding}: {e}")
-                continue
-        
+
         if content is None:
-            # Si todos fallan, intenta con errors='ignore' como último recurso
-            try:
-                with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                self.debug_print("Archivo leído con encoding utf-8 e ignorando errores.")
-            except Exception as e:
-                 messagebox.showerror("Error de Lectura", f"No se pudo leer el archivo '{os.path.basename(filepath)}' con los encodings probados.\n{e}")
-                 return {}
+            # Si todos fallan, utf-8 ignorando errores como último recurso
+            content = raw.decode('utf-8', errors='ignore')
+            used_encoding = 'utf-8'
+            self.debug_print("Archivo leído con encoding utf-8 e ignorando errores.")
 
+        # Mismos saltos de línea que al leer en modo texto
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
 
         data = {}
-        patterns = {
-            'title': r'#TITLE:([^;]+);',
-            'artist': r'#ARTIST:([^;]+);',
-            'bpms': r'#BPMS:([^;]+);',
-            'offset': r'#OFFSET:([^;]+);'
-        }
-
-        for key, pattern in patterns.items():
-            match = re.search(pattern, content, re.IGNORECASE)
-            data[key] = match.group(1).strip() if match else 'Unknown'
-
         charts = []
-        # Patrón mejorado para ser más tolerante con espacios y saltos de línea
-        chart_pattern = r'#NOTES:\s*([^:]*):\s*([^:]*):\s*([^:]*):\s*([^:]*):\s*([^:]*):\s*([^;]+);'
-
-        for match in re.finditer(chart_pattern, content, re.DOTALL | re.IGNORECASE):
-            chart = {
-                'type': match.group(1).strip(),
-                'description': match.group(2).strip(),         # Author/Description
-                'difficulty': match.group(3).strip(),        # Difficulty Name
-                'level': match.group(4).strip(),             # Difficulty Meter
-                'radar': match.group(5).strip().replace('\n','').replace('\r','').replace(' ',''), # Radar values
-                'notes': match.group(6).strip()              # Note data
-            }
-            charts.append(chart)
+        for match in TAG_PATTERN.finditer(content):
+            tag = match.group(1).upper()
+            value = match.group(2)
+            if not value:
+                continue
+
+            if tag in HEADER_TAGS:
+                data.setdefault(HEADER_TAGS[tag], value.strip()) # Solo cuenta la primera aparición
+            elif tag == 'NOTES':
+                fields = value.split(':', 5)
+                if len(fields) < 6 or not fields[5]:
+                    continue
+                chart = {
+                    'type': fields[0].strip(),
+                    'description': fields[1].strip(),   # Author/Description
+                    'difficulty': fields[2].strip(),    # Difficulty Name
+                    'level': fields[3].strip(),         # Difficulty Meter
+                    'radar': fields[4].strip().replace('\n','').replace('\r','').replace(' ',''), # Radar values
+                    'notes': fields[5].strip()          # Note data
+                }
+                charts.append(chart)
+
+        for key in HEADER_TAGS.values():
+            data.setdefault(key, 'Unknown')
 
         data['charts'] = charts
-        data['original_content'] = content
+        # No se guarda una copia del contenido: se vuelve a leer al generar el archivo
+        data['path'] = filepath
+        data['encoding'] = used_encoding
         return data
 
     def analyze_file(self):
@@ -306,6 +385,7 @@ class StepManiaSimplifier:
         
         self.info_text.delete(1.0, tk.END) # Limpiar info anterior
         self.debug_text.delete(1.0, tk.END) # Limpiar debug anterior
+        self.drain_debug_queue() # Descartar mensajes pendientes del análisis anterior
         self.base_chart_combo['values'] = [] # Limpiar combobox de charts
         self.base_chart_var.set("")
 
@@ -322,6 +402,33 @@ class StepManiaSimplifier:
 
 
     def display_file_info(self):
+        chart_options = []
+        for chart in self.chart_data.get('charts', []):
+            chart_options.append(f"{chart.get('difficulty','UnknownDif')} (Lv.{chart.get('level','?')}) - {chart.get('description','NoDesc')}")
+
+        if not chart_options:
+            self.debug_print("No se encontraron charts en los datos parseados.")
+
+        self.base_chart_combo['values'] = chart_options
+        if chart_options:
+            self.base_chart_combo.current(0)
+        else:
+            self.base_chart_var.set("No hay charts disponibles")
+
+        # Primero se muestra la información sin el resumen de notas, que se calcula
+        # cuando la interfaz queda libre
+        self.info_text.delete(1.0, tk.END)
+        self.info_text.insert(1.0, self.format_file_info(chart_options, with_summaries=False))
+        if chart_options:
+            self.root.after_idle(self.show_notes_summaries, self.chart_data, chart_options)
+
+    def show_notes_summaries(self, chart_data: Dict, chart_options: List[str]):
+        if chart_data is not self.chart_data: # Mientras tanto se ha cargado otro archivo
+            return
+        self.info_text.delete(1.0, tk.END)
+        self.info_text.insert(1.0, self.format_file_info(chart_options, with_summaries=True))
+
+    def format_file_info(self, chart_options: List[str], with_summaries: bool) -> str:
         info = f"=== INFORMACIÓN DEL ARCHIVO ===\n"
         info += f"Título: {self.chart_data.get('title', 'N/A')}\n"
         info += f"Artista: {self.chart_data.get('artist', 'N/A')}\n"
@@ -329,71 +436,65 @@ class StepManiaSimplifier:
         info += f"Offset: {self.chart_data.get('offset', 'N/A')}\n\n"
 
         info += "=== CHARTS DISPONIBLES ===\n"
-        chart_options = []
 
-        if not self.chart_data.get('charts'):
+        if not chart_options:
             info += "No se encontraron charts válidos en el archivo.\n"
-            self.debug_print("No se encontraron charts en los datos parseados.")
         else:
-            for i, chart in enumerate(self.chart_data.get('charts', [])):
-                chart_name = f"{chart.get('difficulty','UnknownDif')} (Lv.{chart.get('level','?')}) - {chart.get('description','NoDesc')}"
-                chart_options.append(chart_name)
-
+            for i, (chart, chart_name) in enumerate(zip(self.chart_data['charts'], chart_options)):
                 info += f"{i+1}. {chart_name}\n"
                 info += f"   Tipo: {chart.get('type','N/A')}\n"
 
-                notes_analysis = self.analyze_notes_summary(chart['notes'])
+                if not with_summaries:
+                    info += "   Analizando notas...\n\n"
+                    continue
+
+                notes_analysis = self.get_notes_summary(chart)
                 info += f"   Notas totales: {notes_analysis['total_notes']}\n"
                 info += f"   Saltos: {notes_analysis['jumps']}\n"
                 info += f"   Holds: {notes_analysis['holds']}\n"
                 info += f"   Minas: {notes_analysis['mines']}\n"
                 info += f"   Compases estimados: {notes_analysis['measures']}\n\n"
 
+        return info
 
-        self.base_chart_combo['values'] = chart_options
-        if chart_options:
-            self.base_chart_combo.current(0)
-        else:
-            self.base_chart_var.set("No hay charts disponibles")
-
-
-        self.info_text.delete(1.0, tk.END)
-        self.info_text.insert(1.0, info)
+    def get_notes_summary(self, chart: Dict) -> Dict:
+        # El resumen se guarda en el propio chart para no volver a analizarlo
+        if 'summary' not in chart:
+            chart['summary'] = self.analyze_notes_summary(chart['notes'])
+        return chart['summary']
 
     def analyze_notes_summary(self, notes_data: str) -> Dict:
-        lines = [line.strip() for line in notes_data.split('\n') if line.strip()]
+        # Una canción tiene pocas filas distintas (0000, 1000, 0100...): primero se
+        # cuentan las repeticiones de cada fila y después se analiza cada una una vez
+        rows = Counter()
+        measures = 0
+        for line in notes_data.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == ',':
+                measures += 1
+            elif len(line) >= 4:
+                rows[line[:4]] += 1
 
         total_notes = 0
         jumps = 0
         holds_start = 0 # '2'
         mines = 0
-        measures = 0
 
-        for line in lines:
-            if line.startswith(','):
-                measures += 1
+        for row, count in rows.items():
+            # Solo procesar líneas que parecen ser de notas (caracteres válidos)
+            if not NOTE_LINE_PATTERN.match(row): # Simplificado
                 continue
-            
-            # Solo procesar líneas que parecen ser de notas (longitud y caracteres)
-            if len(line) >= 4 and all(c in '01234MFLK' for c in line[:4].upper()): # Simplificado
-                note_count_in_line = 0
-                for char_idx, char_val in enumerate(line[:4]):
-                    if char_val == '1': # Tap note
-                        total_notes += 1
-                        note_count_in_line +=1
-                    elif char_val == '2': # Hold start
-                        total_notes += 1
-                        holds_start += 1
-                        note_count_in_line +=1
-                    elif char_val == '4': # Roll start (contar como hold)
-                        total_notes += 1
-                        holds_start += 1
-                        note_count_in_line +=1
-                    elif char_val.upper() == 'M': # Mine
-                        mines +=1
-                
-                if note_count_in_line > 1:
-                    jumps +=1
+            taps = row.count('1')              # Tap note
+            holds = row.count('2') + row.count('4') # Hold start / Roll start (contar como hold)
+            note_count_in_line = taps + holds
+
+            total_notes += note_count_in_line * count
+            holds_start += holds * count
+            mines += (row.count('M') + row.count('m')) * count # Mine
+            if note_count_in_line > 1:
+                jumps += count
         
         return {
             'total_notes': total_notes,
@@ -419,44 +520,60 @@ class StepManiaSimplifier:
         
         return new_level
 
-    def simplify_chart(self, chart: Dict) -> Dict:
-        simplified_chart = copy.deepcopy(chart)
+    def get_simplify_options(self) -> Dict:
+        # Copia de las opciones de la interfaz: las variables de Tk solo se leen desde
+        # el hilo principal, y así el hilo de trabajo no las toca
+        remove_subdivisions = {} # sufijo -> porcentaje de notas a mantener
+        for config in self.note_options_config:
+            var_name = config['var_name']
+            if getattr(self, f"remove_{var_name}").get():
+                keep_percentage_str = getattr(self, f"keep_percentage_{var_name}").get()
+                remove_subdivisions[var_name] = float(keep_percentage_str.replace('%','')) / 100.0
+
+        return {
+            'remove_subdivisions': remove_subdivisions,
+            'remove_jumps': self.remove_jumps.get(),
+            'keep_some_jumps': self.keep_some_jumps.get(),
+            'jump_percentage': self.jump_percentage_val.get(),
+            'simplify_holds': self.simplify_holds.get(),
+            'difficulty_name': self.new_difficulty_name.get(),
+            'seed': self.random_seed.get().strip(),
+        }
+
+    def simplify_chart(self, chart: Dict, options: Dict) -> Dict:
+        simplified_chart = dict(chart) # Todos los valores son str y los que cambian se reasignan abajo
+        simplified_chart.pop('summary', None) # El resumen del chart original ya no sirve
+        # Generador propio para cada simplificación: con semilla el resultado es reproducible
+        seed = options['seed']
+        self.rng = random.Random(seed) if seed else random.Random()
         notes_lines = chart['notes'].split('\n')
 
         simplified_lines = []
         current_measure_lines = []
         notes_removed_count = 0
         original_tap_and_hold_notes_count = 0 # Contar solo '1' y '2' para el % de reducción
-
-        # Primera pasada para contar notas originales relevantes
-        for line_idx, line_content in enumerate(notes_lines):
-            stripped_line = line_content.strip()
-            if stripped_line == ',':
-                continue
-            if len(stripped_line) >= 4 and self.is_valid_note_line(stripped_line):
-                for char_note in stripped_line[:4]:
-                    if char_note in '124': # Tap, Hold start, Roll start
-                        original_tap_and_hold_notes_count += 1
-        
-        self.debug_print(f"Notas originales (tap/hold/roll): {original_tap_and_hold_notes_count}")
-
+        final_tap_notes_count = 0 # Notas '1' que quedan, para avisar si el chart se queda vacío
 
         for line in notes_lines:
             stripped_line = line.strip()
             if not stripped_line: # Línea vacía
                 if current_measure_lines: # Procesar compás acumulado si existe
-                    processed_measure, removed_in_measure = self.process_measure(current_measure_lines)
+                    processed_measure, removed_in_measure, notes_in_measure, taps_in_measure = self.process_measure(current_measure_lines, options)
                     simplified_lines.extend(processed_measure)
                     notes_removed_count += removed_in_measure
+                    original_tap_and_hold_notes_count += notes_in_measure
+                    final_tap_notes_count += taps_in_measure
                     current_measure_lines = []
                 simplified_lines.append(line) # Añadir la línea vacía
                 continue
 
             if stripped_line == ',':
                 if current_measure_lines:
-                    processed_measure, removed_in_measure = self.process_measure(current_measure_lines)
+                    processed_measure, removed_in_measure, notes_in_measure, taps_in_measure = self.process_measure(current_measure_lines, options)
                     simplified_lines.extend(processed_measure)
                     notes_removed_count += removed_in_measure
+                    original_tap_and_hold_notes_count += notes_in_measure
+                    final_tap_notes_count += taps_in_measure
                     current_measure_lines = []
                 simplified_lines.append(line) # Añadir la coma
                 continue
@@ -465,19 +582,27 @@ class StepManiaSimplifier:
                 current_measure_lines.append(line) # Usar línea original con sus espacios
             else: # Líneas que no son de notas (comentarios, etc.)
                 if current_measure_lines: # Procesar compás acumulado si lo hubiera antes de esta línea no-nota
-                    processed_measure, removed_in_measure = self.process_measure(current_measure_lines)
+                    processed_measure, removed_in_measure, notes_in_measure, taps_in_measure = self.process_measure(current_measure_lines, options)
                     simplified_lines.extend(processed_measure)
                     notes_removed_count += removed_in_measure
+                    original_tap_and_hold_notes_count += notes_in_measure
+                    final_tap_notes_count += taps_in_measure
                     current_measure_lines = []
                 simplified_lines.append(line)
 
 
         if current_measure_lines: # Procesar el último compás si queda algo
-            processed_measure, removed_in_measure = self.process_measure(current_measure_lines)
+            processed_measure, removed_in_measure, notes_in_measure, taps_in_measure = self.process_measure(current_measure_lines, options)
             simplified_lines.extend(processed_measure)
             notes_removed_count += removed_in_measure
+            original_tap_and_hold_notes_count += notes_in_measure
+            final_tap_notes_count += taps_in_measure
 
+        # Las notas originales (tap/hold/roll) se cuentan al procesar cada compás
+        if self.debug_enabled:
+            self.debug_print(f"Notas originales (tap/hold/roll): {original_tap_and_hold_notes_count}")
         simplified_chart['notes'] = '\n'.join(simplified_lines)
+        simplified_chart['tap_notes'] = final_tap_notes_count
 
         try:
             original_level = int(chart['level'])
@@ -489,20 +614,21 @@ class StepManiaSimplifier:
         if original_tap_and_hold_notes_count > 0:
             notes_removed_percentage = notes_removed_count / original_tap_and_hold_notes_count
         
-        self.debug_print(f"Notas eliminadas: {notes_removed_count}")
-        self.debug_print(f"Porcentaje de notas eliminadas: {notes_removed_percentage:.2%}")
+        if self.debug_enabled:
+            self.debug_print(f"Notas eliminadas: {notes_removed_count}")
+            self.debug_print(f"Porcentaje de notas eliminadas: {notes_removed_percentage:.2%}")
 
         new_level = self.calculate_difficulty_level(original_level, notes_removed_percentage)
 
-        simplified_chart['difficulty'] = self.new_difficulty_name.get()
+        simplified_chart['difficulty'] = options['difficulty_name']
         simplified_chart['level'] = str(new_level)
         
         base_desc = chart['description']
         if "(Simplified)" not in base_desc and "(Easy)" not in base_desc: # Evitar duplicados
-             simplified_chart['description'] = f"{base_desc} ({self.new_difficulty_name.get()})"
+             simplified_chart['description'] = f"{base_desc} ({options['difficulty_name']})"
         else: # Si ya tiene un tag de simplificación, lo reemplazamos o usamos el nuevo
             parts = re.split(r'\s*\(.*\)', base_desc) # Quitar el (tag) viejo
-            simplified_chart['description'] = f"{parts[0].strip()} ({self.new_difficulty_name.get()})"
+            simplified_chart['description'] = f"{parts[0].strip()} ({options['difficulty_name']})"
 
 
         return simplified_chart
@@ -510,103 +636,80 @@ class StepManiaSimplifier:
 
     def is_valid_note_line(self, line: str) -> bool:
         # Una línea de nota válida tiene al menos 4 caracteres y esos son 0-4, M, F, L, K
-        # (considerando mayúsculas para MFLK)
-        if len(line) < 4:
-            return False
-        return all(c in '01234MFLK' for c in line[:4].upper())
+        # (en mayúsculas o minúsculas para MFLK)
+        return NOTE_LINE_PATTERN.match(line) is not None
 
 
-    def process_measure(self, measure_lines: List[str]) -> Tuple[List[str], int]:
+    def process_measure(self, measure_lines: List[str], options: Dict) -> Tuple[List[str], int, int, int]:
         if not measure_lines:
-            return [], 0
+            return [], 0, 0, 0
 
         processed_lines = []
         notes_removed_in_measure = 0
+        original_notes_in_measure = 0
+        tap_notes_in_measure = 0
+        rng_random = self.rng.random
+        remove_subdivisions = options['remove_subdivisions']
+        remove_jumps = options['remove_jumps']
+        simplify_holds = options['simplify_holds']
         
-        num_lines_in_measure = len(measure_lines)
+        subdivisions = measure_subdivisions(len(measure_lines))
 
         for i, original_line_text in enumerate(measure_lines):
-            line_text = original_line_text.strip() # Trabajar con la línea sin espacios extra al inicio/fin
-            
-            # Mantener los espacios originales del inicio para el formato
-            leading_whitespace = ""
-            match_whitespace = re.match(r"(\s*)", original_line_text)
-            if match_whitespace:
-                leading_whitespace = match_whitespace.group(1)
+            # Posición de las 4 columnas de notas; lo normal en un .sm es que no haya sangría
+            notes_start = 0
+            if original_line_text[:1].isspace():
+                notes_start = len(original_line_text) - len(original_line_text.lstrip())
 
-            modified_line_chars = list(line_text[:4]) # Solo los primeros 4 caracteres para notas
-            rest_of_line = line_text[4:] # Comentarios, etc.
+            original_notes = notes = original_line_text[notes_start:notes_start + 4]
+            original_notes_in_measure += notes.count('1') + notes.count('2') + notes.count('4') # Tap, Hold, Roll
 
             # 1. Detección de subdivisión y eliminación de notas rápidas
-            subdivision = self.detect_note_subdivision_in_measure(i, num_lines_in_measure)
-            
-            option_var_name = None
-            if subdivision == "24th+": option_var_name = "24th"
-            elif subdivision == "16th": option_var_name = "16th"
-            elif subdivision == "12th": option_var_name = "12th"
-            elif subdivision == "8th": option_var_name = "8th"
-
-            line_had_notes = any(c in '124' for c in modified_line_chars)
-
-            if option_var_name:
-                remove_this_subdivision = getattr(self, f"remove_{option_var_name}").get()
-                if remove_this_subdivision:
-                    keep_percentage_str = getattr(self, f"keep_percentage_{option_var_name}").get()
-                    keep_percentage = float(keep_percentage_str.replace('%','')) / 100.0
-                    
-                    if random.random() >= keep_percentage: # Si random es MAYOR o IGUAL, se elimina
-                        for k_idx, k_char in enumerate(modified_line_chars):
-                            if k_char in '124': # Tap, Hold, Roll
-                                modified_line_chars[k_idx] = '0'
-                                notes_removed_in_measure += 1
-                        # self.debug_print(f"L{i} ({subdivision}) eliminada (o parte), %keep: {keep_percentage_str}")
-                    # else:
-                        # self.debug_print(f"L{i} ({subdivision}) MANTENIDA por % ({keep_percentage_str})")
+            option_var_name = SUBDIVISION_OPTIONS.get(subdivisions[i])
 
+            if option_var_name in remove_subdivisions:
+                keep_percentage = remove_subdivisions[option_var_name]
+                if rng_random() >= keep_percentage: # Si random es MAYOR o IGUAL, se elimina
+                    removed = notes.count('1') + notes.count('2') + notes.count('4') # Tap, Hold, Roll
+                    if removed:
+                        notes = notes.translate(CLEAR_NOTES)
+                        notes_removed_in_measure += removed
 
-            # 2. Simplificación de saltos (después de posible eliminación por subdivisión)
-            current_notes_in_line = sum(1 for char_note in modified_line_chars if char_note in '124')
-            if current_notes_in_line > 1 and self.remove_jumps.get():
-                # self.debug_print(f"Salto detectado en L{i}: {''.join(modified_line_chars)}")
-                notes_indices_in_jump = [idx for idx, char_note in enumerate(modified_line_chars) if char_note in '124']
-                
-                notes_to_keep_count = 1 # Por defecto, dejar 1 nota de un salto
-                if self.keep_some_jumps.get(): # Si el checkbox "Dejar algunos [saltos]" está activo
-                    percentage_to_keep_jumps = self.jump_percentage_val.get() / 100.0
-                    # self.debug_print(f"  Intentando mantener {percentage_to_keep_jumps*100}% de {current_notes_in_line} notas del salto")
-                    notes_to_keep_count = max(1, int(round(len(notes_indices_in_jump) * percentage_to_keep_jumps)))
-                
-                # self.debug_print(f"  Original: {notes_indices_in_jump}, a mantener: {notes_to_keep_count}")
-                
-                # Mantener las primeras 'notes_to_keep_count' notas, eliminar el resto
-                random.shuffle(notes_indices_in_jump) # Aleatorizar cuáles se quedan
-                notes_to_remove_from_jump = notes_indices_in_jump[notes_to_keep_count:]
 
-                for idx_to_remove in notes_to_remove_from_jump:
-                    if modified_line_chars[idx_to_remove] in '124':
-                        modified_line_chars[idx_to_remove] = '0'
-                        notes_removed_in_measure += 1
-                # self.debug_print(f"  Salto simplificado L{i}: {''.join(modified_line_chars)}")
+            # 2. Simplificación de saltos (después de posible eliminación por subdivisión)
+            if remove_jumps:
+                notes_indices_in_jump = [idx for idx, char_note in enumerate(notes) if char_note in '124']
+                if len(notes_indices_in_jump) > 1:
+                    notes_to_keep_count = 1 # Por defecto, dejar 1 nota de un salto
+                    if options['keep_some_jumps']: # Si el checkbox "Dejar algunos [saltos]" está activo
+                        percentage_to_keep_jumps = options['jump_percentage'] / 100.0
+                        notes_to_keep_count = max(1, int(round(len(notes_indices_in_jump) * percentage_to_keep_jumps)))
+
+                    # Elegir al azar las 'notes_to_keep_count' notas que se quedan, eliminar el resto
+                    notes_to_keep = self.rng.sample(notes_indices_in_jump, notes_to_keep_count)
+                    notes_to_remove_from_jump = set(notes_indices_in_jump).difference(notes_to_keep)
+                    notes = ''.join('0' if idx in notes_to_remove_from_jump else char_note
+                                    for idx, char_note in enumerate(notes))
+                    notes_removed_in_measure += len(notes_to_remove_from_jump)
 
 
             # 3. Simplificación de holds (después de todo lo anterior)
-            if self.simplify_holds.get():
-                for k_idx, k_char in enumerate(modified_line_chars):
-                    if k_char == '2': # Inicio de Hold
-                        modified_line_chars[k_idx] = '1' # Convertir a Tap
-                        # No contamos esto como nota eliminada, es una conversión
-                    elif k_char == '3': # Fin de Hold
-                        modified_line_chars[k_idx] = '0' # Eliminar marcador de fin
-                    elif k_char == '4': # Inicio de Roll
-                         modified_line_chars[k_idx] = '1' # Convertir a Tap
-                    # No se tocan 'L' (fin de roll) ya que no tienen valor numérico en StepMania y son más raros
-
-            processed_lines.append(leading_whitespace + "".join(modified_line_chars) + rest_of_line)
+            # Inicio de Hold/Roll -> Tap (no cuenta como nota eliminada), fin de Hold -> vacío.
+            # No se tocan 'L' (fin de roll) ya que no tienen valor numérico en StepMania y son más raros
+            if simplify_holds:
+                notes = notes.translate(HOLDS_TO_TAPS)
+
+            tap_notes_in_measure += notes.count('1')
+            if notes == original_notes: # Línea sin cambios: se reutiliza tal cual
+                processed_lines.append(original_line_text)
+            else: # Solo se reconstruyen las líneas modificadas, conservando sangría y comentarios
+                processed_lines.append(original_line_text[:notes_start] + notes + original_line_text[notes_start + 4:])
         
-        return processed_lines, notes_removed_in_measure
+        return processed_lines, notes_removed_in_measure, original_notes_in_measure, tap_notes_in_measure
 
 
-    def detect_note_subdivision_in_measure(self, line_index: int, total_lines_in_measure: int) -> str:
+    @staticmethod
+    def detect_note_subdivision_in_measure(line_index: int, total_lines_in_measure: int) -> str:
         """
         Detecta la subdivisión de una nota basada en su índice dentro del compás y el total de líneas.
         Esta es una heurística y puede no ser perfecta para todos los casos de BPM changes o time signatures.
@@ -614,33 +717,9 @@ class StepManiaSimplifier:
         """
         if total_lines_in_measure == 0: return "Unknown"
 
-        # Casos comunes para 4/4 time signature
-        if total_lines_in_measure % 48 == 0: # Probablemente 48ths (o 24ths si son pares)
-            beat_division = 48
-        elif total_lines_in_measure % 32 == 0: # Probablemente 32nds
-            beat_division = 32
-        elif total_lines_in_measure % 24 == 0: # Probablemente 24ths
-            beat_division = 24
-        elif total_lines_in_measure % 16 == 0: # Probablemente 16ths
-            beat_division = 16
-        elif total_lines_in_measure % 12 == 0: # Probablemente 12ths (triplets over 4th)
-            beat_division = 12
-        elif total_lines_in_measure % 8 == 0:  # Probablemente 8ths
-            beat_division = 8
-        elif total_lines_in_measure % 6 == 0: # Probablemente 6ths (triplets over 8th, raro pero posible)
-             beat_division = 6
-        elif total_lines_in_measure % 4 == 0:  # Probablemente 4ths
-            beat_division = 4
-        elif total_lines_in_measure % 3 == 0 and total_lines_in_measure <= 12 : # Podría ser un compás de 3/4 en 4ths, o 4/4 en 3 notas por alguna razón
-            beat_division = total_lines_in_measure # ej. 3 notas: 3rd, 6 notas: 6th
-        elif total_lines_in_measure % 2 == 0 and total_lines_in_measure <= 8:
-            beat_division = total_lines_in_measure
-        else: # Casos menos comunes o compases con pocas notas
-            if total_lines_in_measure > 16 : return "24th+" # Si hay muchas, default a muy rápidas
-            if total_lines_in_measure > 12 : return "16th"
-            if total_lines_in_measure > 8 : return "12th"
-            if total_lines_in_measure > 4 : return "8th"
-            return "4th"
+        beat_division = measure_beat_division(total_lines_in_measure)
+        if isinstance(beat_division, str): # Compás sin división clara: la subdivisión ya está decidida
+            return beat_division
 
         # Simplificación de la lógica de subdivisión
         # El `line_index` nos dice en qué "slot" de la subdivisión más fina cae esta línea.
@@ -648,24 +727,43 @@ class StepManiaSimplifier:
         # Si es 2, 6, 10, 14, es un 8th (pero no 4th).
         # El resto son 16ths.
 
-        if line_index % (beat_division / 4) == 0: return "4th"
-        if beat_division >= 8 and line_index % (beat_division / 8) == 0: return "8th"
-        if beat_division >= 12 and line_index % (beat_division / 12) == 0: return "12th"
-        if beat_division >= 16 and line_index % (beat_division / 16) == 0: return "16th"
+        # `line_index % (beat_division / N) == 0` en enteros: (line_index * N) % beat_division == 0.
+        # Es exacto también cuando beat_division no es múltiplo de N (compases de 2, 3 o 6 líneas)
+        if (line_index * 4) % beat_division == 0: return "4th"
+        if beat_division >= 8 and (line_index * 8) % beat_division == 0: return "8th"
+        if beat_division >= 12 and (line_index * 12) % beat_division == 0: return "12th"
+        if beat_division >= 16 and (line_index * 16) % beat_division == 0: return "16th"
         if beat_division >= 24 : return "24th+" # Cubre 24th, 32nd, 48th, etc.
         
         return "Unknown" # Default por si acaso
 
 
     def debug_print(self, message):
+        # Los mensajes se encolan y flush_debug los inserta de una vez desde el hilo de Tk,
+        # en vez de redibujar el widget con cada línea
+        if not self.debug_enabled:
+            return
         if hasattr(self, 'debug_text') and self.debug_text:
+            self.debug_queue.put(message)
+            print(f"DEBUG: {message}") # También imprimir a consola
+
+    def drain_debug_queue(self) -> List[str]:
+        messages = []
+        while True:
             try:
-                self.debug_text.insert(tk.END, f"{message}\n")
+                messages.append(self.debug_queue.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def flush_debug(self):
+        messages = self.drain_debug_queue()
+        try:
+            if messages:
+                self.debug_text.insert(tk.END, "\n".join(messages) + "\n")
                 self.debug_text.see(tk.END)
-                self.root.update_idletasks() # Forzar actualización de la UI
-            except tk.TclError: # En caso de que el widget ya no exista (ej. al cerrar)
-                pass
-            print(f"DEBUG: {message}") # También imprimir a consola
+            self.root.after(50, self.flush_debug)
+        except tk.TclError: # En caso de que el widget ya no exista (ej. al cerrar)
+            pass
 
 
     def remove_jump_notes(self, line: str) -> str:
@@ -674,8 +772,7 @@ class StepManiaSimplifier:
         if len(line) < 4:
             return line
 
-        chars = list(line)
-        jump_notes_indices = [i for i, char_note in enumerate(chars[:4]) if char_note in '124']
+        jump_notes_indices = [i for i, char_note in enumerate(line[:4]) if char_note in '124']
 
         if len(jump_notes_indices) > 1: # Es un salto
             if self.remove_jumps.get(): # Si la opción general de eliminar saltos está activa
@@ -685,27 +782,18 @@ class StepManiaSimplifier:
                     percentage_to_keep = self.jump_percentage_val.get() / 100.0
                     notes_to_keep_count = max(1, int(round(len(jump_notes_indices) * percentage_to_keep)))
 
-                # Aleatorizar y seleccionar las notas a mantener
-                random.shuffle(jump_notes_indices)
-                notes_to_remove_indices = jump_notes_indices[notes_to_keep_count:]
-                
-                for idx_to_remove in notes_to_remove_indices:
-                    chars[idx_to_remove] = '0'
+                # Elegir al azar las notas a mantener; solo se reconstruye la línea si es un salto
+                notes_to_keep = self.rng.sample(jump_notes_indices, notes_to_keep_count)
+                return ''.join('0' if i in jump_notes_indices and i not in notes_to_keep else char_note
+                               for i, char_note in enumerate(line[:4])) + line[4:]
         
-        return "".join(chars)
+        return line
 
 
     def simplify_hold_notes(self, line: str) -> str:
          # Esta función ya no se usa directamente, su lógica está en process_measure
-        modified_line = list(line)
-        for i, char_val in enumerate(modified_line[:4]):
-            if char_val == '2': # Hold Start
-                modified_line[i] = '1'
-            elif char_val == '3': # Hold End
-                modified_line[i] = '0'
-            elif char_val == '4': # Roll Start
-                modified_line[i] = '1'
-        return "".join(modified_line)
+        # Hold Start -> '1', Hold End -> '0', Roll Start -> '1'
+        return line[:4].translate(HOLDS_TO_TAPS) + line[4:]
 
 
     def generate_simplified(self):
@@ -726,15 +814,46 @@ class StepManiaSimplifier:
             base_chart = self.chart_data['charts'][selected_index]
             self.debug_print(f"Generando versión simplificada para: {base_chart.get('difficulty')} (Lv.{base_chart.get('level')})")
 
-            simplified_chart = self.simplify_chart(base_chart)
+            # La simplificación va en un hilo aparte para no congelar la interfaz
+            options = self.get_simplify_options()
+            self.generate_button.config(state="disabled")
+            self.simplify_result = None
+            worker = threading.Thread(target=self.run_simplification, args=(base_chart, options), daemon=True)
+            worker.start()
+            self.root.after(50, self.check_simplification, worker, self.chart_data, base_chart, options)
+
+        except Exception as e:
+            messagebox.showerror("Error", f"Error al generar archivo simplificado: {str(e)}")
+            self.debug_print(f"Excepción en generate_simplified: {str(e)}")
+
+    def run_simplification(self, base_chart: Dict, options: Dict):
+        # Se ejecuta en el hilo de trabajo: no toca ningún widget, solo deja el resultado
+        try:
+            self.simplify_result = (self.simplify_chart(base_chart, options), None)
+        except Exception as e:
+            import traceback
+            self.simplify_result = (None, (e, traceback.format_exc()))
+
+    def check_simplification(self, worker: threading.Thread, source_data: Dict, base_chart: Dict, options: Dict):
+        # source_data es el archivo analizado al pulsar el botón, aunque luego se cargue otro
+        if worker.is_alive():
+            self.root.after(50, self.check_simplification, worker, source_data, base_chart, options)
+            return
+
+        self.generate_button.config(state="normal")
+        simplified_chart, error = self.simplify_result
+        if error:
+            e, trace = error
+            messagebox.showerror("Error", f"Error al generar archivo simplificado: {str(e)}")
+            self.debug_print(f"Excepción en generate_simplified: {str(e)}")
+            self.debug_print(trace)
+            return
+        self.save_simplified(source_data, base_chart, simplified_chart, options)
 
-            # Contar notas '1' (tap) en el chart simplificado para una verificación rápida
-            simplified_tap_notes_count = 0
-            for line_s in simplified_chart['notes'].split('\n'):
-                if self.is_valid_note_line(line_s.strip()):
-                    for char_s in line_s.strip()[:4]:
-                        if char_s == '1':
-                            simplified_tap_notes_count +=1
+    def save_simplified(self, source_data: Dict, base_chart: Dict, simplified_chart: Dict, options: Dict):
+        try:
+            # Notas '1' (tap) que quedan, contadas ya al simplificar cada compás
+            simplified_tap_notes_count = simplified_chart['tap_notes']
             
             self.debug_print(f"Chart simplificado: {simplified_tap_notes_count} notas '1' (tap) finales.")
             self.debug_print(f"Nivel original: {base_chart['level']}, Nivel calculado: {simplified_chart['level']}")
@@ -747,44 +866,54 @@ class StepManiaSimplifier:
                     self.debug_print("Generación cancelada por el usuario debido a 0 notas tap.")
                     return
 
-            new_content = self.chart_data['original_content']
+            with open(source_data['path'], 'r', encoding=source_data['encoding'], errors='ignore') as f:
+                original_content = f.read()
 
             # Asegurarse de que el nuevo bloque de notas se añade al final del archivo
-            if not new_content.endswith('\n\n'):
-                if new_content.endswith('\n'):
-                    new_content += '\n'
+            padding = ''
+            if not original_content.endswith('\n\n'):
+                if original_content.endswith('\n'):
+                    padding = '\n'
                 else:
-                    new_content += '\n\n'
+                    padding = '\n\n'
             
             # Formato del bloque de notas
             # //---------------dance-single - [Simplificado (Easy)]----------------
             comment_desc = simplified_chart['description'].replace(':','-') # Evitar problemas con ':' en comentarios
             comment = f"//---------------{simplified_chart['type']} - {comment_desc}----------------\n"
 
-            new_notes_block = comment
-            new_notes_block += "#NOTES:\n"
-            new_notes_block += f"     {simplified_chart['type']}:\n"
-            new_notes_block += f"     {simplified_chart['description']}:\n" # Ya incluye el (Simplified) o (Easy)
-            new_notes_block += f"     {simplified_chart['difficulty']}:\n"
-            new_notes_block += f"     {simplified_chart['level']}:\n"
-            new_notes_block += f"     {simplified_chart['radar']}:\n" # Usar el radar original
-            new_notes_block += f"{simplified_chart['notes']};\n\n"
-
-            new_content += new_notes_block
-
-            original_path = self.current_file
+            # Todas las piezas se unen en un solo join, sin copias intermedias del archivo
+            new_content = ''.join([
+                original_content,
+                padding,
+                comment,
+                "#NOTES:\n",
+                f"     {simplified_chart['type']}:\n",
+                f"     {simplified_chart['description']}:\n", # Ya incluye el (Simplified) o (Easy)
+                f"     {simplified_chart['difficulty']}:\n",
+                f"     {simplified_chart['level']}:\n",
+                f"     {simplified_chart['radar']}:\n", # Usar el radar original
+                simplified_chart['notes'],
+                ";\n\n",
+            ])
+
+            original_path = source_data['path']
             base_name = os.path.splitext(original_path)[0]
             
             # Construir nombre de archivo con tag de dificultad si es posible
-            difficulty_tag = self.new_difficulty_name.get().replace(" ", "_")
+            difficulty_tag = options['difficulty_name'].replace(" ", "_")
             new_path = f"{base_name}_{difficulty_tag}_simplified.sm"
             
             # Intentar guardar con el encoding original si es conocido, sino utf-8
             source_encoding = 'utf-8' # Default
             # (No tenemos una forma fácil de saber el encoding original exacto después de leerlo)
 
-            with open(new_path, 'w', encoding=source_encoding, errors='ignore') as f:
-                f.write(new_content)
+            # Se codifica todo de una vez y se escribe en binario, con los mismos saltos
+            # de línea que pondría el modo texto en este sistema
+            if os.linesep != '\n':
+                new_content = new_content.replace('\n', os.linesep)
+            with open(new_path, 'wb', buffering=1 << 20) as f:
+                f.write(new_content.encode(source_encoding, errors='ignore'))
 
             messagebox.showinfo("Éxito", f"Archivo simplificado guardado como:\n{new_path}")
             self.debug_print(f"Archivo simplificado guardado en: {new_path}")
@@ -4,10 +4,13 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import os
 import sys
 import traceback
 import subprocess
+import json
+import hashlib
 import shutil
 import numpy as np
 import random
@@ -30,6 +33,37 @@ try:
 except ImportError:
     pass
 
+# madmom RNN processors are expensive to build (they load several model
+# files), so they are created on first use and shared across analyses.
+_RNN_BEAT = None
+_RNN_DOWNBEAT = None
+
+
+def _rnn_beat_processor():
+    global _RNN_BEAT
+    if _RNN_BEAT is None:
+        _RNN_BEAT = madmom.features.beats.RNNBeatProcessor()
+    return _RNN_BEAT
+
+
+def _rnn_downbeat_processor():
+    global _RNN_DOWNBEAT
+    if _RNN_DOWNBEAT is None:
+        _RNN_DOWNBEAT = madmom.features.downbeats.RNNDownBeatProcessor()
+    return _RNN_DOWNBEAT
+
+
+# Analysis results are cached per audio file so regenerating charts for the
+# same song skips the (slow) audio analysis.
+ANALYSIS_CACHE_DIR = Path.home() / '.cache' / 'sm_generator'
+ANALYSIS_CACHE_VERSION = 1
+
+
+def _warm_up_madmom():
+    """Load the madmom models ahead of time (run in a background thread)."""
+    _rnn_beat_processor()
+    _rnn_downbeat_processor()
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Audio Conversion Helper
@@ -111,33 +145,25 @@ def convert_to_mp4_video(input_path: str, callback=None) -> str:
             cb("ffprobe not found; converting video to be safe", 3)
             return False
         try:
+            # One probe for all streams: first video codec + any audio
             probe = subprocess.run(
                 [
                     'ffprobe', '-v', 'error',
-                    '-select_streams', 'v:0',
-                    '-show_entries', 'stream=codec_name',
-                    '-of', 'default=nokey=1:noprint_wrappers=1',
-                    str(path)
-                ],
-                capture_output=True,
-                text=True,
-                timeout=15
-            )
-            vcodec = probe.stdout.strip() if probe.returncode == 0 else ''
-
-            probe_a = subprocess.run(
-                [
-                    'ffprobe', '-v', 'error',
-                    '-select_streams', 'a',
-                    '-show_entries', 'stream=codec_name',
-                    '-of', 'default=nokey=1:noprint_wrappers=1',
+                    '-show_entries', 'stream=codec_type,codec_name',
+                    '-of', 'json',
                     str(path)
                 ],
                 capture_output=True,
                 text=True,
                 timeout=15
             )
-            has_audio = bool(probe_a.stdout.strip())
+            streams = []
+            if probe.returncode == 0:
+                streams = json.loads(probe.stdout or '{}').get('streams', [])
+            vcodecs = [st.get('codec_name', '') for st in streams
+                       if st.get('codec_type') == 'video']
+            vcodec = vcodecs[0] if vcodecs else ''
+            has_audio = any(st.get('codec_type') == 'audio' for st in streams)
 
             return vcodec == 'h264' and not has_audio
         except Exception:
@@ -208,16 +234,40 @@ class AudioAnalyzer:
         self.beat_times = np.array([])
         self.onset_times = np.array([])
         self.onset_strengths = np.array([])
+        self.onset_env = None        # onset-strength envelope (shared)
         self.mel_spec = None
         self.n_mels = 128
+        self.band_energy = None              # (n_frames, 4) mean dB per band
+        self.dominant_band_per_frame = None  # (n_frames,) argmax of the above
+        self._bass_energy = None     # mean |STFT| of the lowest ~170 Hz
         self.music_start = 0.0       # time (s) when music actually begins
         self.first_downbeat = 0.0    # time (s) of the first aligned downbeat
         self.rms = None              # RMS energy envelope
+        self._rms_norm = None        # rms / peak, for O(1) lookups
+        self._beat_act = None        # cached madmom beat activations
+        self._db_act = None          # cached madmom downbeat activations
 
     # -- helpers --
     def _log(self, msg, pct=0):
         self._cb(msg, pct)
 
+    def _ensure_onset_env(self):
+        """Compute the onset-strength envelope once and reuse it."""
+        if self.onset_env is None:
+            self.onset_env = librosa.onset.onset_strength(y=self.y, sr=self.sr)
+        return self.onset_env
+
+    def _get_beat_activations(self):
+        """Run madmom's beat RNN once and reuse it for tempo and beats."""
+        if self._beat_act is None:
+            self._beat_act = _rnn_beat_processor()(self.filepath)
+        return self._beat_act
+
+    def _get_downbeat_activations(self):
+        if self._db_act is None:
+            self._db_act = _rnn_downbeat_processor()(self.filepath)
+        return self._db_act
+
     # -- pipeline steps --
     def load_audio(self):
         self._log("Loading audio file …", 5)
@@ -232,10 +282,24 @@ class AudioAnalyzer:
 
     def compute_mel_spectrogram(self):
         self._log("Computing mel spectrogram …", 15)
+        # One STFT feeds both the mel spectrogram and the bass envelope used
+        # by the downbeat detector (same n_fft / hop as melspectrogram).
+        stft_mag = np.abs(librosa.stft(self.y, n_fft=2048, hop_length=512))
+        self._bass_energy = np.mean(stft_mag[:8, :], axis=0)  # lowest ~170 Hz
         S = librosa.feature.melspectrogram(
-            y=self.y, sr=self.sr, n_mels=self.n_mels, fmax=8000
+            S=stft_mag ** 2, sr=self.sr, n_mels=self.n_mels, fmax=8000
         )
+        del stft_mag
         self.mel_spec = librosa.power_to_db(S, ref=np.max)
+
+        # Per-frame band energies for get_dominant_band(); the last band
+        # takes any leftover mel bins when n_mels is not divisible by 4.
+        bs = self.n_mels // 4
+        self.band_energy = np.stack([
+            self.mel_spec[i * bs: (i + 1) * bs if i < 3 else self.n_mels].mean(axis=0)
+            for i in range(4)
+        ], axis=1)
+        self.dominant_band_per_frame = self.band_energy.argmax(axis=1).astype(np.int8)
         self._log("Mel spectrogram ready", 25)
 
     def detect_music_start(self):
@@ -244,18 +308,18 @@ class AudioAnalyzer:
         self._log("Detecting music start …", 28)
         # Compute RMS in short frames
         self.rms = librosa.feature.rms(y=self.y, frame_length=2048, hop_length=512)[0]
-        rms_times = librosa.frames_to_time(
-            np.arange(len(self.rms)), sr=self.sr, hop_length=512
-        )
 
         # Threshold: 5% of the peak RMS (catches soft intros but ignores noise)
         peak_rms = np.max(self.rms)
         threshold = peak_rms * 0.05
+        self._rms_norm = (
+            self.rms / peak_rms if peak_rms > 0 else np.zeros_like(self.rms)
+        )
 
         # Find the first frame that exceeds the threshold
-        above = np.where(self.rms > threshold)[0]
-        if len(above) > 0:
-            self.music_start = float(rms_times[above[0]])
+        first = int(np.argmax(self.rms > threshold))
+        if self.rms[first] > threshold:
+            self.music_start = first * 512 / self.sr   # frame → seconds
         else:
             self.music_start = 0.0
 
@@ -271,43 +335,60 @@ class AudioAnalyzer:
         onset-autocorrelation and spectral-flux tempogram to find the
         true tempo.
         """
-        self._log("  Method 1: beat_track …", 33)
-        onset_env = librosa.onset.onset_strength(y=self.y, sr=self.sr)
-
-        # --- Method 1: default beat_track ---
-        tempo1, _ = librosa.beat.beat_track(y=self.y, sr=self.sr,
-                                            onset_envelope=onset_env)
-        t1 = float(tempo1[0]) if hasattr(tempo1, '__len__') else float(tempo1)
-
-        # --- Method 2: beat_track with alternative start_bpm prior ---
-        # librosa's beat_track uses a Bayesian prior centred on start_bpm
-        # (default 120).  Running again with start_bpm=95 biases toward
-        # the 80-110 range common in reggaeton / trap / hip-hop / latin
+        onset_env = self._ensure_onset_env()
+
+        def _as_float(tempo):
+            return float(tempo[0]) if hasattr(tempo, '__len__') else float(tempo)
+
+        # Only the tempo of beat_track() was used, and that is exactly
+        # feature.tempo() on the onset tempogram; methods 1-3 therefore
+        # share one tempogram (same 8 s window feature.tempo would use).
+        self._log("  Method 1: tempo (start_bpm=120) …", 33)
+        tg = librosa.feature.tempogram(
+            onset_envelope=onset_env, sr=self.sr,
+            win_length=librosa.time_to_frames(8.0, sr=self.sr).item()
+        )
+
+        # --- Method 1: default prior (start_bpm=120) ---
+        t1 = _as_float(librosa.feature.tempo(tg=tg, sr=self.sr))
+
+        # --- Method 2: alternative start_bpm prior ---
+        # The tempo estimate uses a prior centred on start_bpm
+        # (default 120).  Using start_bpm=95 biases toward the
+        # 80-110 range common in reggaeton / trap / hip-hop / latin
         # and acts as a cross-check to catch tempo-doubling errors.
-        self._log("  Method 2: beat_track (start_bpm=95) …", 34)
-        tempo2, _ = librosa.beat.beat_track(y=self.y, sr=self.sr,
-                                            onset_envelope=onset_env,
-                                            start_bpm=95)
-        t2 = float(tempo2[0]) if hasattr(tempo2, '__len__') else float(tempo2)
+        self._log("  Method 2: tempo (start_bpm=95) …", 34)
+        t2 = _as_float(librosa.feature.tempo(tg=tg, sr=self.sr, start_bpm=95))
 
-        # --- Method 3: tempogram autocorrelation (gives multiple peaks) ---
+        # --- Method 3: per-frame tempogram peaks (multiple candidates) ---
         self._log("  Method 3: tempo via tempogram …", 35)
-        tempo3 = librosa.feature.tempo(
-            onset_envelope=onset_env, sr=self.sr, aggregate=None
-        )
-        # tempo3 is an array of one or more candidates
+        tempo3 = librosa.feature.tempo(tg=tg, sr=self.sr, aggregate=None)
         t3_candidates = [float(t) for t in np.atleast_1d(tempo3) if 40 < float(t) < 240]
 
         # --- Method 4: onset-autocorrelation on percussive component ---
-        self._log("  Method 4: percussive onset autocorrelation …", 36)
-        y_perc = librosa.effects.percussive(self.y, margin=3.0)
-        onset_perc = librosa.onset.onset_strength(y=y_perc, sr=self.sr)
-        tempo4, _ = librosa.beat.beat_track(y=y_perc, sr=self.sr,
-                                            onset_envelope=onset_perc)
-        t4 = float(tempo4[0]) if hasattr(tempo4, '__len__') else float(tempo4)
+        # HPSS is by far the most expensive step, so it only runs as a
+        # tie-breaker when the two priors disagree.  The percussive onset
+        # envelope is taken straight from the masked magnitude spectrogram
+        # (no istft / re-STFT round trip).
+        raw = [t1, t2] + t3_candidates
+        if abs(t1 - t2) > 5:
+            self._log("  Method 4: percussive onset autocorrelation …", 36)
+            S_perc = librosa.decompose.hpss(
+                np.abs(librosa.stft(self.y)), margin=3.0
+            )[1]
+            onset_perc = librosa.onset.onset_strength(
+                S=librosa.power_to_db(
+                    librosa.feature.melspectrogram(S=S_perc ** 2, sr=self.sr)
+                ),
+                sr=self.sr,
+            )
+            t4 = _as_float(librosa.feature.tempo(onset_envelope=onset_perc,
+                                                 sr=self.sr))
+            raw.insert(2, t4)
+        else:
+            self._log("  Method 4 skipped (methods 1 and 2 agree)", 36)
 
         # --- Collect all raw candidates ---
-        raw = [t1, t2, t4] + t3_candidates
         self._log(f"  Raw candidates: {[f'{t:.1f}' for t in raw]}", 37)
 
         # --- Generate octave variants for each raw candidate ---
@@ -323,31 +404,26 @@ class AudioAnalyzer:
 
         # --- Score each candidate ---
         # Prefer tempos whose beat grid aligns well with detected onsets
-        best_score = -1
-        best_bpm = t1
         onset_times_for_score = librosa.frames_to_time(
             np.where(onset_env > np.percentile(onset_env, 75))[0],
             sr=self.sr
         )
 
-        for bpm_c in candidates:
-            beat_period = 60.0 / bpm_c
-            # For each onset, check distance to nearest beat-grid line
-            total_score = 0.0
-            for ot in onset_times_for_score:
-                phase = (ot / beat_period) % 1.0
-                # How close is this onset to a beat grid line? (0=perfect)
-                dist = min(phase, 1.0 - phase)
-                total_score += max(0.0, 0.5 - dist)  # bonus if within half-beat
-            # Normalise
-            total_score /= max(len(onset_times_for_score), 1)
-            # Small bias toward the 80-130 range (most pop/reggaeton/hip-hop)
-            if 80 <= bpm_c <= 130:
-                total_score *= 1.10
-
-            if total_score > best_score:
-                best_score = total_score
-                best_bpm = bpm_c
+        # All candidates at once: rows = candidate BPMs, columns = onsets
+        bpms = np.fromiter(candidates, dtype=np.float64, count=len(candidates))
+        periods = 60.0 / bpms
+        phases = (onset_times_for_score[None, :] / periods[:, None]) % 1.0
+        # How close is each onset to a beat grid line? (0=perfect)
+        dists = np.minimum(phases, 1.0 - phases)
+        # Bonus if within half-beat, normalised by the number of onsets
+        scores = (np.maximum(0.0, 0.5 - dists).sum(axis=1)
+                  / max(len(onset_times_for_score), 1))
+        # Small bias toward the 80-130 range (most pop/reggaeton/hip-hop)
+        scores *= np.where((bpms >= 80) & (bpms <= 130), 1.10, 1.0)
+
+        best_idx = int(np.argmax(scores))
+        best_bpm = float(bpms[best_idx])
+        best_score = float(scores[best_idx])
 
         self._log(f"  Best BPM candidate: {best_bpm:.1f} (score {best_score:.4f})", 38)
         return best_bpm
@@ -382,8 +458,7 @@ class AudioAnalyzer:
         else:
             self._log("  madmom: estimating tempo …", 34)
             try:
-                act_proc = madmom.features.beats.RNNBeatProcessor()
-                act = act_proc(self.filepath)
+                act = self._get_beat_activations()
                 tempo_proc = madmom.features.tempo.TempoEstimationProcessor(fps=100)
                 tempi = tempo_proc(act)  # [[bpm, confidence], …]
                 if len(tempi) > 0:
@@ -402,8 +477,7 @@ class AudioAnalyzer:
         # ---- Beat tracking ----
         self._log("  madmom: tracking beats …", 36)
         try:
-            act_proc = madmom.features.beats.RNNBeatProcessor()
-            act = act_proc(self.filepath)
+            act = self._get_beat_activations()
             beat_proc = madmom.features.beats.DBNBeatTrackingProcessor(
                 fps=100, min_bpm=max(40, self.bpm - 30),
                 max_bpm=min(240, self.bpm + 30)
@@ -416,7 +490,10 @@ class AudioAnalyzer:
             )
             all_beat_times = librosa.frames_to_time(beat_frames, sr=self.sr)
 
-        self.beat_times = all_beat_times[all_beat_times >= self.music_start]
+        # beat times are sorted: drop everything before the music starts
+        self.beat_times = all_beat_times[
+            np.searchsorted(all_beat_times, self.music_start):
+        ]
         discarded = len(all_beat_times) - len(self.beat_times)
         if discarded > 0:
             self._log(f"  Discarded {discarded} beats in leading silence", 37)
@@ -424,8 +501,7 @@ class AudioAnalyzer:
         # ---- Downbeat detection ----
         self._log("  madmom: detecting downbeats …", 38)
         try:
-            db_proc = madmom.features.downbeats.RNNDownBeatProcessor()
-            db_act = db_proc(self.filepath)
+            db_act = self._get_downbeat_activations()
             dbn = madmom.features.downbeats.DBNDownBeatTrackingProcessor(
                 beats_per_bar=[4, 3], fps=100
             )
@@ -433,7 +509,9 @@ class AudioAnalyzer:
 
             # beat_num == 1 means downbeat (beat 1 of the bar)
             downbeats = downbeat_info[downbeat_info[:, 1] == 1]
-            valid_db = downbeats[downbeats[:, 0] >= self.music_start - 0.1]
+            valid_db = downbeats[
+                np.searchsorted(downbeats[:, 0], self.music_start - 0.1):
+            ]
 
             if len(valid_db) > 0:
                 self.first_downbeat = float(valid_db[0, 0])
@@ -466,7 +544,10 @@ class AudioAnalyzer:
         all_beat_times = librosa.frames_to_time(beat_frames, sr=self.sr)
 
         # ---- Filter out beats before music actually starts ----
-        self.beat_times = all_beat_times[all_beat_times >= self.music_start]
+        # beat times are sorted: drop everything before the music starts
+        self.beat_times = all_beat_times[
+            np.searchsorted(all_beat_times, self.music_start):
+        ]
         discarded = len(all_beat_times) - len(self.beat_times)
         if discarded > 0:
             self._log(f"  Discarded {discarded} beats in leading silence", 39)
@@ -492,16 +573,14 @@ class AudioAnalyzer:
             return
 
         # Onset strength at every beat position
-        onset_env = librosa.onset.onset_strength(y=self.y, sr=self.sr)
+        onset_env = self._ensure_onset_env()
         beat_frames = librosa.time_to_frames(self.beat_times, sr=self.sr)
         beat_frames = np.clip(beat_frames, 0, len(onset_env) - 1)
         beat_strengths = onset_env[beat_frames]
 
         # Also get low-frequency (bass) energy at each beat — bass hits
         # strongly correlate with downbeats in most genres.
-        S = np.abs(librosa.stft(self.y, n_fft=2048, hop_length=512))
-        bass_band = S[:8, :]  # lowest ~170 Hz
-        bass_energy = np.mean(bass_band, axis=0)
+        bass_energy = self._bass_energy
         bass_frames = librosa.time_to_frames(
             self.beat_times, sr=self.sr, hop_length=512
         )
@@ -511,50 +590,40 @@ class AudioAnalyzer:
         bass_max = np.max(bass_at_beats) if np.max(bass_at_beats) > 0 else 1.0
         bass_at_beats = bass_at_beats / bass_max
 
-        best_phase = 0
-        best_score = -1.0
-
-        for phase in range(4):
-            # Indices of beats that would be "beat 1" under this phase
-            db_idx = np.arange(phase, len(beat_strengths), 4)
-            other_idx = np.array(
-                [i for i in range(len(beat_strengths)) if (i - phase) % 4 != 0]
-            )
-
-            if len(db_idx) == 0:
-                continue
-
-            db_str = beat_strengths[db_idx]
-            other_str = (
-                beat_strengths[other_idx] if len(other_idx) else np.array([1.0])
-            )
+        # Score all 4 phases at once.  Row p of phase_mask marks the beats
+        # that would be "beat 1" if the bar starts on detected beat p.
+        n_beats = len(beat_strengths)
+        phase_mask = (np.arange(n_beats)[None, :] - np.arange(4)[:, None]) % 4 == 0
+        n_db = phase_mask.sum(axis=1)
+        n_other = n_beats - n_db          # > 0: there are at least 8 beats
 
-            # Accent ratio: downbeats should be louder
-            strength_ratio = np.mean(db_str) / (np.mean(other_str) + 1e-8)
+        # Accent ratio: downbeats should be louder
+        db_sum = (phase_mask * beat_strengths[None, :]).sum(axis=1)
+        other_sum = beat_strengths.sum() - db_sum
+        strength_ratio = (db_sum / n_db) / (other_sum / n_other + 1e-8)
 
-            # RMS energy at candidate downbeat positions
-            db_times = self.beat_times[db_idx]
-            rms_values = np.array([self.get_rms_at(t) for t in db_times])
-            rms_score = np.mean(rms_values)
+        # RMS energy at candidate downbeat positions
+        rms_at_beats = self.get_rms_at_times(self.beat_times)
+        rms_score = (phase_mask * rms_at_beats[None, :]).sum(axis=1) / n_db
 
-            # Bass energy boost — bass drum typically hits on beat 1
-            bass_score = np.mean(bass_at_beats[db_idx])
+        # Bass energy boost — bass drum typically hits on beat 1
+        bass_score = (phase_mask * bass_at_beats[None, :]).sum(axis=1) / n_db
 
-            # Combined score
-            score = strength_ratio * (1.0 + rms_score) * (1.0 + bass_score)
+        # Combined score
+        scores = strength_ratio * (1.0 + rms_score) * (1.0 + bass_score)
 
-            # Slight preference for phase 0 (first detected beat is often
-            # beat 1, so break ties in its favour)
-            if phase == 0:
-                score *= 1.05
+        # Slight preference for phase 0 (first detected beat is often
+        # beat 1, so break ties in its favour)
+        scores[0] *= 1.05
 
-            self._log(f"    Downbeat phase {phase}: score={score:.3f} "
-                      f"(accent={strength_ratio:.2f}, rms={rms_score:.2f}, "
-                      f"bass={bass_score:.2f})", 39)
+        for phase in range(4):
+            self._log(f"    Downbeat phase {phase}: score={scores[phase]:.3f} "
+                      f"(accent={strength_ratio[phase]:.2f}, "
+                      f"rms={rms_score[phase]:.2f}, "
+                      f"bass={bass_score[phase]:.2f})", 39)
 
-            if score > best_score:
-                best_score = score
-                best_phase = phase
+        best_phase = int(np.argmax(scores))
+        best_score = float(scores[best_phase])
 
         self.first_downbeat = float(self.beat_times[best_phase])
 
@@ -570,7 +639,7 @@ class AudioAnalyzer:
 
     def detect_onsets(self):
         self._log("Detecting onsets …", 50)
-        env = librosa.onset.onset_strength(y=self.y, sr=self.sr)
+        env = self._ensure_onset_env()
         frames = librosa.onset.onset_detect(
             y=self.y, sr=self.sr, onset_envelope=env, backtrack=False
         )
@@ -609,32 +678,96 @@ class AudioAnalyzer:
           2 → mid-high    → Up
           3 → high        → Right
         """
-        frame = int(librosa.time_to_frames([t], sr=self.sr)[0])
-        frame = np.clip(frame, 0, self.mel_spec.shape[1] - 1)
-        spec = self.mel_spec[:, frame]
-        bs = self.n_mels // 4
-        energies = [
-            np.mean(spec[i * bs: (i + 1) * bs if i < 3 else self.n_mels])
-            for i in range(4)
-        ]
-        return int(np.argmax(energies))
+        bands = self.dominant_band_per_frame
+        return int(bands[self._frame_at(t, len(bands))])
 
     def get_rms_at(self, t: float) -> float:
         """Return the normalised RMS energy (0..1) at time *t*."""
-        if self.rms is None:
+        if self._rms_norm is None:
             return 1.0
-        frame = int(librosa.time_to_frames([t], sr=self.sr, hop_length=512)[0])
-        frame = np.clip(frame, 0, len(self.rms) - 1)
-        peak = np.max(self.rms)
-        return float(self.rms[frame] / peak) if peak > 0 else 0.0
+        return float(self._rms_norm[self._frame_at(t, len(self._rms_norm))])
+
+    def get_rms_at_times(self, times) -> np.ndarray:
+        """Vectorised get_rms_at() for an array of times."""
+        times = np.asarray(times, dtype=np.float64)
+        if self._rms_norm is None:
+            return np.ones(len(times))
+        frames = (times * self.sr).astype(int) // 512
+        return self._rms_norm[np.clip(frames, 0, len(self._rms_norm) - 1)]
+
+    def _frame_at(self, t: float, n_frames: int) -> int:
+        """Same frame as librosa.time_to_frames (hop 512), clipped to range."""
+        frame = int(t * self.sr) // 512
+        return min(max(frame, 0), n_frames - 1)
+
+    # -- analysis cache --
+    _CACHED_FIELDS = (
+        'duration', 'bpm', 'beat_times', 'onset_times', 'onset_strengths',
+        'music_start', 'first_downbeat', 'dominant_band_per_frame', '_rms_norm',
+    )
+
+    def _cache_path(self) -> Path:
+        """Cache file for this audio file + analysis settings."""
+        st = os.stat(self.filepath)
+        key = '|'.join(str(v) for v in (
+            ANALYSIS_CACHE_VERSION, os.path.abspath(self.filepath),
+            st.st_mtime_ns, st.st_size, self.sr, self.n_mels,
+            self.bpm_override, 'madmom' if HAS_MADMOM else 'librosa',
+        ))
+        return ANALYSIS_CACHE_DIR / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def _load_cache(self) -> bool:
+        try:
+            path = self._cache_path()
+            if not path.exists():
+                return False
+            with np.load(path, allow_pickle=False) as data:
+                for name in self._CACHED_FIELDS:
+                    value = data[name]
+                    setattr(self, name, value if value.ndim else float(value))
+        except Exception:
+            return False
+        return True
+
+    def _save_cache(self):
+        try:
+            path = self._cache_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.savez_compressed(
+                path, **{name: getattr(self, name) for name in self._CACHED_FIELDS}
+            )
+        except Exception as e:
+            self._log(f"  Could not write analysis cache: {e}", 70)
 
     # -- public API --
     def analyze(self):
-        self.load_audio()
-        self.compute_mel_spectrogram()
-        self.detect_music_start()
+        """Run the full analysis pipeline.
+
+        Afterwards ``y`` and ``mel_spec`` are released (None); chart
+        generation uses the per-frame band / RMS lookups instead.
+        """
+        if self._load_cache():
+            self._log(f"Using cached analysis: {self.duration:.1f}s, "
+                      f"BPM ≈ {self.bpm:.1f}", 70)
+            return self
+
+        # Loading the madmom models takes a while; do it while the audio is
+        # being decoded.  A failure here is ignored: the same error shows up
+        # again (and is handled) when the processors are actually used.
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            if HAS_MADMOM:
+                ex.submit(_warm_up_madmom)
+            self.load_audio()
+            self.compute_mel_spectrogram()
+            self.detect_music_start()
         self.detect_bpm_and_beats()
         self.detect_onsets()
+        self._save_cache()
+
+        # Chart generation only needs the per-frame tables; free the raw
+        # samples and the full mel spectrogram.
+        self.y = None
+        self.mel_spec = None
         self._log("Audio analysis complete!", 70)
         return self
 
@@ -648,6 +781,10 @@ class StepChartGenerator:
 
     LEFT_FOOT  = [0, 1]   # Left, Down
     RIGHT_FOOT = [2, 3]   # Up, Right
+    # jump partners for each arrow (every other lane)
+    OTHER_ARROWS = tuple(tuple(i for i in range(4) if i != a) for a in range(4))
+    # opposite-foot lanes for each arrow (downbeat jumps)
+    OPPOSITE_FOOT = (RIGHT_FOOT, RIGHT_FOOT, LEFT_FOOT, LEFT_FOOT)
 
     CONFIGS = {
         'Beginner': dict(
@@ -720,26 +857,28 @@ class StepChartGenerator:
 
     # -- arrow assignment --
     def _pick_arrow(self, t, prev, cfg, color=None):
+        rng = self.rng
         band = self.az.get_dominant_band(t)
         arrow = self._map_band_to_arrow(t, band, cfg)
 
         # 30 % random variety
-        if self.rng.random() < 0.30:
-            arrow = self.rng.randint(0, 3)
+        if rng.random() < 0.30:
+            arrow = rng.randint(0, 3)
 
         # easy diffs: alternate left-side / right-side
         if cfg['alt_pref'] and prev:
             last = prev[-1]
-            arrow = self.rng.choice(
+            arrow = rng.choice(
                 self.RIGHT_FOOT if last in self.LEFT_FOOT else self.LEFT_FOOT
             )
 
         # avoid jacks on lower diffs
         if not cfg['jack_ok'] and prev:
+            last = prev[-1]
             for _ in range(12):
-                if arrow != prev[-1]:
+                if arrow != last:
                     break
-                arrow = self.rng.randint(0, 3)
+                arrow = rng.randint(0, 3)
 
         row = [0, 0, 0, 0]
         row[arrow] = 1
@@ -752,9 +891,8 @@ class StepChartGenerator:
             elif color == 'blue':
                 jump_prob = jump_prob * 0.4
 
-        if jump_prob and self.rng.random() < jump_prob:
-            alt = [i for i in range(4) if i != arrow]
-            row[self.rng.choice(alt)] = 1
+        if jump_prob and rng.random() < jump_prob:
+            row[rng.choice(self.OTHER_ARROWS[arrow])] = 1
 
         return row, arrow
 
@@ -767,13 +905,16 @@ class StepChartGenerator:
         spr = spm / subdiv
         offset = offset_time
 
+        # Normalised RMS at every grid row, looked up once
+        row_times = offset + np.arange(len(measures) * subdiv) * spr
+        energies = self.az.get_rms_at_times(row_times).tolist()
+
         # ---------- Rule 1: Mute arrows during quiet sections ----------
         for m_idx, meas in enumerate(measures):
             for r_idx, row in enumerate(meas):
                 if not any(v > 0 for v in row):
                     continue
-                t = offset + (m_idx * subdiv + r_idx) * spr
-                energy = self.az.get_rms_at(t)
+                energy = energies[m_idx * subdiv + r_idx]
                 if energy < 0.08:          # very quiet
                     row[:] = [0, 0, 0, 0]
 
@@ -843,40 +984,28 @@ class StepChartGenerator:
             for m_idx, meas in enumerate(measures):
                 # Downbeat = first row of each measure
                 row = meas[0]
-                if any(v > 0 for v in row) and sum(row) == 1:
-                    t = offset + (m_idx * subdiv) * spr
-                    energy = self.az.get_rms_at(t)
+                if sum(row) == 1:
+                    energy = energies[m_idx * subdiv]
                     # Strong downbeat → maybe add a jump
                     if energy > 0.70 and self.rng.random() < 0.20:
                         active = row.index(1)
                         # Add opposite-side arrow for jump
-                        if active in self.LEFT_FOOT:
-                            partner = self.rng.choice(self.RIGHT_FOOT)
-                        else:
-                            partner = self.rng.choice(self.LEFT_FOOT)
+                        partner = self.rng.choice(self.OPPOSITE_FOOT[active])
                         row[partner] = 1
 
         # ---------- Rule 4: Smooth runs (hard+ diffs) ----------
         # When 4+ consecutive notes exist, make them flow L→D→U→R or reverse
         if cfg['level'] >= 8:
-            flat = [(m_idx, r_idx, meas[r_idx])
-                    for m_idx, meas in enumerate(measures)
-                    for r_idx in range(len(meas))]
-            run_start = None
-            run_len = 0
-            for i, (mi, ri, row) in enumerate(flat):
-                has_note = any(v > 0 for v in row) and sum(row) == 1
-                if has_note:
-                    if run_start is None:
-                        run_start = i
-                    run_len += 1
-                else:
-                    if run_len >= 4:
-                        self._smooth_run(flat, run_start, run_len)
-                    run_start = None
-                    run_len = 0
-            if run_len >= 4:
-                self._smooth_run(flat, run_start, run_len)
+            rows = [row for meas in measures for row in meas]
+            single = np.fromiter((sum(row) == 1 for row in rows),
+                                 dtype=np.int8, count=len(rows))
+            # +1 where a run of single notes starts, -1 just past its end
+            edges = np.diff(single, prepend=0, append=0)
+            starts = np.flatnonzero(edges == 1)
+            lengths = np.flatnonzero(edges == -1) - starts
+            for start, length in zip(starts.tolist(), lengths.tolist()):
+                if length >= 4:
+                    self._smooth_run(rows, start, length)
 
         # ---------- Rule 5: Gap between jumps ----------
         # Ensure at least 2 rows between consecutive jumps
@@ -903,8 +1032,7 @@ class StepChartGenerator:
                     if sum(row) == 0:
                         continue
                     if self._row_color(subdiv, r_idx) == 'yellow':
-                        t = offset + (m_idx * subdiv + r_idx) * spr
-                        yellow_rows.append((r_idx, self.az.get_rms_at(t)))
+                        yellow_rows.append((r_idx, energies[m_idx * subdiv + r_idx]))
 
                 if len(yellow_rows) > 1:
                     yellow_rows.sort(key=lambda x: x[1], reverse=True)
@@ -943,7 +1071,7 @@ class StepChartGenerator:
 
         return measures
 
-    def _smooth_run(self, flat, start, length):
+    def _smooth_run(self, rows, start, length):
         """Turn a consecutive run into a flowing L→D→U→R pattern."""
         # Pick direction
         patterns = [
@@ -954,11 +1082,26 @@ class StepChartGenerator:
         ]
         pat = self.rng.choice(patterns)
         for i in range(length):
-            _, _, row = flat[start + i]
+            row = rows[start + i]
             arrow = pat[i % 4]
             row[:] = [0, 0, 0, 0]
             row[arrow] = 1
 
+    def _snap_to_rows(self, times, offset, spr, keep=None):
+        """Return the grid rows of *times* that land close enough to a row.
+
+        Only times inside the music (music_start .. duration) whose
+        position is within 0.45 rows of a grid line are kept.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        pos = (times - offset) / spr
+        ri = np.round(pos)
+        mask = ((times >= self.az.music_start) & (times <= self.az.duration)
+                & (ri >= 0) & (np.abs(pos - ri) < 0.45))
+        if keep is not None:
+            mask &= keep
+        return ri[mask].astype(np.int64)
+
     # -- chart for one difficulty --
     def generate_chart(self, name):
         cfg   = self.CONFIGS[name]
@@ -972,29 +1115,25 @@ class StepChartGenerator:
         n_meas = int(np.ceil((self.az.duration - offset) / spm)) + 1
 
         # ---- collect grid positions that should have notes ----
-        note_grid = set()
-
         # beats
         beats = self.az.beat_times[::cfg['beat_skip']]
-        for bt in beats:
-            if bt >= self.az.music_start and bt <= self.az.duration:
-                ri = round((bt - offset) / spr)
-                if ri >= 0 and abs((bt - offset) / spr - ri) < 0.45:
-                    note_grid.add(ri)
+        beat_rows = self._snap_to_rows(beats, offset, spr)
 
         # onsets
-        for ot, os_ in zip(self.az.onset_times, self.az.onset_strengths):
-            if os_ >= cfg['onset_thresh'] and ot >= self.az.music_start and ot <= self.az.duration:
-                ri = round((ot - offset) / spr)
-                if ri >= 0 and abs((ot - offset) / spr - ri) < 0.45:
-                    note_grid.add(ri)
+        onset_rows = self._snap_to_rows(
+            self.az.onset_times, offset, spr,
+            keep=self.az.onset_strengths >= cfg['onset_thresh'],
+        )
+        # one flag per grid row (rows are small dense integers)
+        n_rows = n_meas * subdiv
+        note_grid = np.zeros(n_rows, dtype=bool)
+        rows = np.concatenate([beat_rows, onset_rows])
+        note_grid[rows[rows < n_rows]] = True
 
         # Medium: favor more red/blue pulses based on energy
         if cfg['level'] == 6:
-            total_rows = n_meas * subdiv
-            for gi in range(total_rows):
-                if gi in note_grid:
-                    continue
+            energies = self.az.get_rms_at_times(offset + np.arange(n_rows) * spr).tolist()
+            for gi in np.flatnonzero(~note_grid).tolist():
                 r_idx = gi % subdiv
                 color = self._row_color(subdiv, r_idx)
                 if color not in ('red', 'blue'):
@@ -1002,44 +1141,43 @@ class StepChartGenerator:
                 trow = offset + gi * spr
                 if trow < self.az.music_start or trow > self.az.duration:
                     continue
-                rms = self.az.get_rms_at(trow)
+                rms = energies[gi]
                 base = 0.18 if color == 'red' else 0.12
                 prob = base * min(1.0, rms / 0.6)
                 if self.rng.random() < prob:
-                    note_grid.add(gi)
+                    note_grid[gi] = True
 
         # density cap
         max_notes = int(self.az.duration * cfg['max_nps'])
-        if len(note_grid) > max_notes:
-            lst = sorted(note_grid)
-            step = len(lst) / max_notes
-            note_grid = {lst[int(i * step)] for i in range(max_notes)}
+        note_rows = np.flatnonzero(note_grid)
+        if len(note_rows) > max_notes:
+            step = len(note_rows) / max_notes
+            picks = (np.arange(max_notes) * step).astype(np.int64)
+            note_grid[:] = False
+            note_grid[note_rows[picks]] = True
 
         # ---- build measures ----
-        measures, prev = [], []
-        for m in range(n_meas):
-            mrows = []
-            for r in range(subdiv):
-                gi   = m * subdiv + r
-                trow = offset + gi * spr
-                if gi in note_grid and 0 <= trow <= self.az.duration:
-                    color = self._row_color(subdiv, r)
-                    row, arrow = self._pick_arrow(trow, prev, cfg, color=color)
-                    mrows.append(row)
-                    prev.append(arrow)
-                    prev = prev[-8:]
-                else:
-                    mrows.append([0, 0, 0, 0])
-            measures.append(mrows)
+        # only rows that carry a note need an arrow; the rest stay empty
+        measures = [[[0, 0, 0, 0] for _ in range(subdiv)] for _ in range(n_meas)]
+        prev = []
+        for gi in np.flatnonzero(note_grid).tolist():
+            trow = offset + gi * spr
+            if not 0 <= trow <= self.az.duration:
+                continue
+            m, r = divmod(gi, subdiv)
+            color = self._row_color(subdiv, r)
+            row, arrow = self._pick_arrow(trow, prev, cfg, color=color)
+            measures[m][r] = row
+            prev.append(arrow)
+            prev = prev[-8:]
 
         # ---- post-processing ----
         measures = self._postprocess(measures, subdiv, cfg, offset)
 
         # trim trailing empty measures (keep at least 1)
-        while len(measures) > 1 and all(
-            all(v == 0 for v in r) for r in measures[-1]
-        ):
-            measures.pop()
+        last = next((m for m in range(len(measures) - 1, 0, -1)
+                     if any(any(r) for r in measures[m])), 0)
+        del measures[last + 1:]
 
         note_count = sum(
             1 for ms in measures for r in ms if any(v > 0 for v in r)
@@ -1068,6 +1206,11 @@ class StepChartGenerator:
 # .sm File Writer
 # ──────────────────────────────────────────────────────────────────────────────
 
+# "0000" … "1111", indexed by the row's arrows read as a 4-bit number
+ROW2STR = [f"{a}{b}{c}{d}"
+           for a in (0, 1) for b in (0, 1) for c in (0, 1) for d in (0, 1)]
+
+
 class SMFileWriter:
     """Serialises step charts to the StepMania .sm format."""
 
@@ -1121,29 +1264,29 @@ class SMFileWriter:
             f"{bgchanges}"
         )
 
-        parts = [hdr]
-        for name in ('Beginner', 'Easy', 'Medium', 'Hard', 'Challenge'):
-            if name not in self.charts:
-                continue
-            ch = self.charts[name]
-            notes_hdr = (
-                f"\n//---------------dance-single - {name}---------------\n"
-                f"#NOTES:\n"
-                f"     dance-single:\n"
-                f"     :\n"
-                f"     {name}:\n"
-                f"     {ch['level']}:\n"
-                f"     0.000000,0.000000,0.000000,0.000000,0.000000:\n"
-            )
-            measure_strs = []
-            for meas in ch['measures']:
-                rows = '\n'.join(''.join(str(v) for v in r) for r in meas)
-                measure_strs.append(rows)
-            notes_body = '\n,\n'.join(measure_strs) + '\n;\n'
-            parts.append(notes_hdr + notes_body)
-
+        # Write each chart as soon as it is serialised so only one chart's
+        # text is held in memory at a time.
         with open(self.path, 'w', encoding='utf-8') as f:
-            f.writelines(parts)
+            f.write(hdr)
+            for name in ('Beginner', 'Easy', 'Medium', 'Hard', 'Challenge'):
+                if name not in self.charts:
+                    continue
+                ch = self.charts[name]
+                f.write(
+                    f"\n//---------------dance-single - {name}---------------\n"
+                    f"#NOTES:\n"
+                    f"     dance-single:\n"
+                    f"     :\n"
+                    f"     {name}:\n"
+                    f"     {ch['level']}:\n"
+                    f"     0.000000,0.000000,0.000000,0.000000,0.000000:\n"
+                )
+                f.write('\n,\n'.join(
+                    '\n'.join(ROW2STR[r[0] << 3 | r[1] << 2 | r[2] << 1 | r[3]]
+                              for r in meas)
+                    for meas in ch['measures']
+                ))
+                f.write('\n;\n')
         return self.path
 
 
@@ -1350,13 +1493,14 @@ class App:
 
     def _pipeline(self, inp, out, vid, diffs, seed, bpm_override=None):
         try:
-            # Convert to MP3 if needed
-            mp3_path = convert_to_mp3(inp, callback=self._log)
+            # Convert to MP3 / MP4 if needed (independent ffmpeg jobs)
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                mp3_job = ex.submit(convert_to_mp3, inp, callback=self._log)
+                vid_job = (ex.submit(convert_to_mp4_video, vid, callback=self._log)
+                           if vid else None)
+                mp3_path = mp3_job.result()
+                video_path = vid_job.result() if vid_job else None
 
-            video_path = None
-            if vid:
-                video_path = convert_to_mp4_video(vid, callback=self._log)
-            
             az = AudioAnalyzer(inp, callback=self._log, bpm_override=bpm_override)
             az.analyze()
 
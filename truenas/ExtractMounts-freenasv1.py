@@ -11,11 +11,9 @@ or migration reporting of share configurations.
 
 DB_FILE = 'freenas-v1.db'
 
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+def row_get(row, key, default=None):
+    """dict.get() for sqlite3.Row (missing column -> default)"""
+    return row[key] if key in row.keys() else default
 
 def print_section(title):
     print("\n" + "#" * 60)
@@ -26,7 +24,7 @@ def dump_row(row, indent=2):
     """Print all columns that have data (ignore None or empty)"""
     max_len = 0
     # Calculate width for alignment
-    valid_keys = [k for k, v in row.items() if v is not None and v != '']
+    valid_keys = [k for k in row.keys() if row[k] is not None and row[k] != '']
     if not valid_keys: return
     
     max_len = max(len(k) for k in valid_keys)
@@ -48,15 +46,15 @@ def get_smb_shares(cursor):
             return
 
         for share in shares:
-            print(f"\n--- Share: {share.get('cifs_name', 'No Name')} ---")
+            print(f"\n--- Share: {row_get(share, 'cifs_name', 'No Name')} ---")
             
             # Print main path
-            print(f"  Main Path     : {share.get('cifs_path', 'N/A')}")
+            print(f"  Main Path     : {row_get(share, 'cifs_path', 'N/A')}")
             
             # Print Hosts Allow/Deny specifically if they exist
-            if share.get('cifs_hostsallow'):
+            if row_get(share, 'cifs_hostsallow'):
                 print(f"  HOSTS ALLOW    : {share['cifs_hostsallow']}")
-            if share.get('cifs_hostsdeny'):
+            if row_get(share, 'cifs_hostsdeny'):
                 print(f"  HOSTS DENY     : {share['cifs_hostsdeny']}")
                 
             # Print the rest of the properties dynamically
@@ -79,30 +77,39 @@ def get_nfs_shares(cursor):
         # Try to detect the name of the paths table
         path_table = None
         try:
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sharing_nfs_share_paths'")
-            if cursor.fetchone(): path_table = 'sharing_nfs_share_paths'
-            else:
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sharing_nfs_share_path'")
-                if cursor.fetchone(): path_table = 'sharing_nfs_share_path'
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                           "AND name IN ('sharing_nfs_share_paths', 'sharing_nfs_share_path')")
+            tables = {r['name'] for r in cursor.fetchall()}
+            for name in ('sharing_nfs_share_paths', 'sharing_nfs_share_path'):
+                if name in tables:
+                    path_table = name
+                    break
         except:
             pass
 
+        # Read every share's paths in one query instead of one per share
+        paths_by_id = {}
+        paths_error = None
+        if path_table:
+            try:
+                cursor.execute(f"SELECT share_id, path FROM {path_table}")
+                for r in cursor.fetchall():
+                    paths_by_id.setdefault(r['share_id'], []).append(r['path'])
+            except Exception as e:
+                paths_error = f"Error reading paths: {e}"
+
         for share in nfs_shares:
-            share_id = share.get('id')
+            share_id = row_get(share, 'id')
             print(f"\n--- NFS Share ID: {share_id} ---")
 
             # 1. Intentar obtener rutas (Paths)
-            paths = []
-            if path_table:
-                try:
-                    cursor.execute(f"SELECT path FROM {path_table} WHERE share_id = ?", (share_id,))
-                    rows = cursor.fetchall()
-                    paths = [r['path'] for r in rows]
-                except Exception as e:
-                    paths = [f"Error reading paths: {e}"]
+            if paths_error:
+                paths = [paths_error]
+            else:
+                paths = paths_by_id.get(share_id, [])
             
             # Fallback for older versions where the path was in the main table
-            if not paths and 'nfs_path' in share and share['nfs_path']:
+            if not paths and 'nfs_path' in share.keys() and share['nfs_path']:
                 paths = [share['nfs_path']]
 
             if paths:
@@ -111,9 +118,9 @@ def get_nfs_shares(cursor):
                 print(f"  PATHS          : [NOT FOUND OR EMPTY]")
 
             # 2. Hosts / Networks
-            if share.get('nfs_network'):
+            if row_get(share, 'nfs_network'):
                 print(f"  ALLOWED NETWORKS: {share['nfs_network']}")
-            if share.get('nfs_hosts'):
+            if row_get(share, 'nfs_hosts'):
                 print(f"  ALLOWED HOSTS  : {share['nfs_hosts']}")
 
             # 3. Other details
@@ -129,7 +136,7 @@ def main():
         return
 
     conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = dict_factory
+    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
     get_smb_shares(cursor)